@@ -0,0 +1,210 @@
+"""JSON API только для чтения: ленты, пост и его комментарии.
+
+Строки сериализуются прямо из .values() без моделей и шаблонов.
+Страницы курсорные (?after= / ?before=, ?limit=), набор полей
+задаётся ?fields=a,b. ETag, 304 и кэш страниц для анонимов те же,
+что у HTML-страниц (conditional_page).
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import Http404, JsonResponse
+
+from . import generations, timeline
+from .authors import request_author
+from .conditional import conditional_page
+from .models import Comment, Group, Post
+from .pagination import CursorPaginator
+
+User = get_user_model()
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+POST_AUTHOR_KEY = "post-author:{}"
+
+# Имя поля в ответе -> поле для .values()
+POST_FIELDS = {
+    "id": "id",
+    "pub_date": "pub_date",
+    "author": "author__username",
+    "group": "group__slug",
+    "excerpt": "excerpt",
+    "text": "text_html",
+    "image": "image",
+    "thumbnail": "thumbnail_url",
+    "comment_count": "comment_count",
+}
+LIST_FIELDS = ("id", "pub_date", "author", "group", "excerpt", "thumbnail", "comment_count")
+DETAIL_FIELDS = tuple(POST_FIELDS)
+COMMENT_FIELDS = {
+    "id": "id",
+    "created": "created",
+    "author": "author__username",
+    "text": "text_html",
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def error(message, status):
+    return JsonResponse({"detail": message}, status=status)
+
+
+def _fields(request, available, default):
+    """Пары (имя, поле) из ?fields=, по умолчанию default."""
+    names = request.GET.get("fields")
+    names = [name.strip() for name in names.split(",") if name.strip()] if names else default
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise BadRequest("Неизвестные поля: {}".format(", ".join(unknown)))
+    return [(name, available[name]) for name in names]
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit должен быть числом")
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def _serialize(rows, fields):
+    result = []
+    for row in rows:
+        item = {name: row[lookup] for name, lookup in fields}
+        if item.get("image"):
+            item["image"] = settings.MEDIA_URL + item["image"]
+        result.append(item)
+    return result
+
+
+def _page(request, queryset, fields, ordering=("-pub_date", "-id"), owner=None, not_found=None):
+    """Курсорная страница строк .values() в виде ответа API.
+
+    owner - queryset группы или поста, которому принадлежат строки.
+    Его наличие проверяется только для пустой страницы, так что
+    обычный ответ обходится без лишнего запроса.
+    """
+    lookups = {lookup for _, lookup in fields} | {name.lstrip("-") for name in ordering}
+    paginator = CursorPaginator(queryset.values(*lookups), _limit(request), ordering=ordering)
+    page = paginator.get_page(after=request.GET.get("after"), before=request.GET.get("before"))
+    if not page.object_list and owner is not None and not owner.exists():
+        return error(not_found, 404)
+    return JsonResponse({
+        "results": _serialize(page.object_list, fields),
+        "next": page.next_cursor,
+        "previous": page.previous_cursor,
+    })
+
+
+def api_view(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as exception:
+            return error(str(exception), 400)
+    return wrapper
+
+
+@conditional_page(lambda request: [generations.INDEX])
+@api_view
+def posts(request):
+    return _page(request, Post.objects.all(), _fields(request, POST_FIELDS, LIST_FIELDS))
+
+
+@conditional_page(lambda request, slug: [generations.group(slug)])
+@api_view
+def group_posts(request, slug):
+    return _page(
+        request, Post.objects.filter(group__slug=slug), _fields(request, POST_FIELDS, LIST_FIELDS),
+        owner=Group.objects.filter(slug=slug), not_found="Группа не найдена",
+    )
+
+
+def _author(request, username):
+    try:
+        return request_author(request, username)
+    except Http404:
+        return None
+
+
+def _author_scopes(request, username):
+    author = _author(request, username)
+    return [generations.author(author.pk) if author else generations.INDEX]
+
+
+@conditional_page(_author_scopes)
+@api_view
+def user_posts(request, username):
+    author = _author(request, username)
+    if author is None:
+        return error("Пользователь не найден", 404)
+    return _page(request, Post.objects.filter(author=author.pk), _fields(request, POST_FIELDS, LIST_FIELDS))
+
+
+@conditional_page(lambda request: [generations.INDEX, generations.follow(request.user.pk)])
+@api_view
+def follow_posts(request):
+    if not request.user.is_authenticated:
+        return error("Нужна авторизация", 401)
+    fields = _fields(request, POST_FIELDS, LIST_FIELDS)
+    paginator = CursorPaginator(timeline.feed(request.user).values("post_id", "pub_date", "id"), _limit(request))
+    page = paginator.get_page(after=request.GET.get("after"), before=request.GET.get("before"))
+    ids = [entry["post_id"] for entry in page.object_list]
+    lookups = {lookup for _, lookup in fields} | {"id"}
+    rows = {row["id"]: row for row in Post.objects.filter(id__in=ids).values(*lookups)}
+    return JsonResponse({
+        "results": _serialize([rows[pk] for pk in ids if pk in rows], fields),
+        "next": page.next_cursor,
+        "previous": page.previous_cursor,
+    })
+
+
+def _post_author_id(post_id):
+    """Автор у поста не меняется, поэтому его id лежит в кэше без срока."""
+    key = POST_AUTHOR_KEY.format(post_id)
+    author_id = cache.get(key)
+    if author_id is None:
+        author_id = Post.objects.filter(pk=post_id).values_list("author_id", flat=True).first()
+        if author_id is None:
+            cache.delete(key)
+        else:
+            cache.set(key, author_id, timeout=None)
+    return author_id
+
+
+def _post_scopes(request, post_id):
+    # Имя автора есть в ответе. Области читают и ETag, и кэш страниц,
+    # и заголовки прокси: автора берём один раз за запрос
+    cached = getattr(request, "post_author", None)
+    if cached is None or cached[0] != post_id:
+        cached = request.post_author = (post_id, _post_author_id(post_id))
+    author_id = cached[1]
+    if author_id is None:
+        return [generations.post(post_id)]
+    return [generations.post(post_id), generations.author(author_id)]
+
+
+@conditional_page(_post_scopes)
+@api_view
+def post_detail(request, post_id):
+    fields = _fields(request, POST_FIELDS, DETAIL_FIELDS)
+    row = Post.objects.filter(id=post_id).values(*{lookup for _, lookup in fields}).first()
+    if row is None:
+        return error("Пост не найден", 404)
+    return JsonResponse(_serialize([row], fields)[0])
+
+
+@conditional_page(_post_scopes)
+@api_view
+def post_comments(request, post_id):
+    return _page(
+        request, Comment.objects.filter(post=post_id),
+        _fields(request, COMMENT_FIELDS, tuple(COMMENT_FIELDS)), ordering=("created", "id"),
+        owner=Post.objects.filter(id=post_id), not_found="Пост не найден",
+    )
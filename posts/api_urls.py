@@ -0,0 +1,12 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path("posts/", api.posts, name="api_posts"),
+    path("posts/<int:post_id>/", api.post_detail, name="api_post"),
+    path("posts/<int:post_id>/comments/", api.post_comments, name="api_post_comments"),
+    path("groups/<slug:slug>/posts/", api.group_posts, name="api_group_posts"),
+    path("users/<str:username>/posts/", api.user_posts, name="api_user_posts"),
+    path("follow/posts/", api.follow_posts, name="api_follow_posts"),
+]
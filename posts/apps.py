@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from . import signals, slowlog  # noqa: F401
+        # Обработчики очереди posts/outbox.py из <app>/outbox.py
+        autodiscover_modules("outbox")
@@ -0,0 +1,61 @@
+"""Карточка автора для profile и post_view.
+
+Пользователь вместе со счётчиками читается одним запросом и лежит в
+кэше по username. Сигналы Post, Follow и User сбрасывают карточку.
+Подписан ли зритель на автора, зависит от зрителя, поэтому это
+считается отдельно в is_following().
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import Http404
+
+from .counters import counters_for
+from .models import Follow
+
+User = get_user_model()
+
+CARD_KEY = "author_card:{}"
+CARD_TIMEOUT = 60 * 60
+# Пароль и прочие поля в кэш не попадают
+CARD_FIELDS = (
+    "id", "username", "first_name", "last_name",
+    "counters__post_count", "counters__following_count", "counters__follower_count",
+)
+
+
+def author_card(username):
+    """Автор с заполненным user.counters или 404."""
+    key = CARD_KEY.format(username)
+    user = cache.get(key)
+    if user is None:
+        try:
+            user = User.objects.select_related("counters").only(*CARD_FIELDS).get(username=username)
+        except User.DoesNotExist:
+            # Карточки не будет: другие запросы не должны её ждать
+            cache.delete(key)
+            raise Http404("Нет пользователя {}".format(username))
+        user.counters = counters_for(user)
+        cache.set(key, user, CARD_TIMEOUT)
+    return user
+
+
+def request_author(request, username):
+    # Карточку читают и ETag, и сама view: берём её один раз за запрос
+    card = getattr(request, "author_card", None)
+    if card is None or card.username != username:
+        card = request.author_card = author_card(username)
+    return card
+
+
+def is_following(viewer, author):
+    if not viewer.is_authenticated or viewer.pk == author.pk:
+        return False
+    return Follow.objects.filter(user=viewer, author_id=author.pk).exists()
+
+
+def forget(*usernames):
+    cache.delete_many([CARD_KEY.format(username) for username in usernames])
+
+
+def forget_ids(*user_ids):
+    forget(*User.objects.filter(pk__in=user_ids).values_list("username", flat=True))
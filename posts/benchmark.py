@@ -0,0 +1,146 @@
+"""Замеры страниц тестовым клиентом: задержка, запросы к базе, память.
+
+routes() перечисляет запрос на каждое имя URL из posts/urls.py и
+posts/api_urls.py, его же использует QueryBudgetTest. Задержки
+считаются без tracemalloc, пик памяти - отдельным проходом под ним.
+Пишущие запросы выполняются, поэтому run() откатывает транзакцию.
+Кэш на время замеров подменяется своим (isolated_caches()): очистка
+перед холодными замерами и записи откаченных запросов не доходят до
+общего L2 сайта.
+"""
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+
+from . import sqlaudit
+from .profiling import percentile
+from .models import Follow, Group, Post, User
+
+BENCH_ALIAS = "benchmark"
+BENCH_CACHE = {
+    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    "LOCATION": "yatube-benchmark",
+}
+
+
+def routes(post, reader, group_slug, stranger):
+    """(имя URL, пользователь, метод, адрес, данные) для каждого маршрута.
+
+    reader подписан на автора post и не подписан на stranger.
+    """
+    author, post_id = post.author, post.pk
+    return [
+        ('index', None, 'get', '/', {}),
+        ('group', None, 'get', '/group/{}/'.format(group_slug), {}),
+        ('search', None, 'get', '/search/', {'q': 'кот'}),
+        ('profile', None, 'get', '/{}/'.format(author.username), {}),
+        ('post', None, 'get', '/{}/{}/'.format(author.username, post_id), {}),
+        ('post', reader, 'get', '/{}/{}/'.format(author.username, post_id), {}),
+        ('follow_index', reader, 'get', '/follow/', {}),
+        ('new_post', reader, 'get', '/new/', {}),
+        ('post_edit', author, 'get', '/{}/{}/edit/'.format(author.username, post_id), {}),
+        ('add_comment', reader, 'post', '/{}/{}/comment/'.format(author.username, post_id), {'text': 'Ещё'}),
+        ('post_comments', None, 'get', '/{}/{}/comments/'.format(author.username, post_id), {}),
+        ('profile_follow', reader, 'get', '/{}/follow/'.format(stranger.username), {}),
+        ('profile_unfollow', reader, 'get', '/{}/unfollow/'.format(author.username), {}),
+        ('rss', None, 'get', '/rss/', {}),
+        ('atom', None, 'get', '/atom/', {}),
+        ('group_rss', None, 'get', '/group/{}/rss/'.format(group_slug), {}),
+        ('group_atom', None, 'get', '/group/{}/atom/'.format(group_slug), {}),
+        ('profile_rss', None, 'get', '/{}/rss/'.format(author.username), {}),
+        ('profile_atom', None, 'get', '/{}/atom/'.format(author.username), {}),
+        ('api_posts', None, 'get', '/api/v1/posts/', {}),
+        ('api_post', None, 'get', '/api/v1/posts/{}/'.format(post_id), {}),
+        ('api_post_comments', None, 'get', '/api/v1/posts/{}/comments/'.format(post_id), {}),
+        ('api_group_posts', None, 'get', '/api/v1/groups/{}/posts/'.format(group_slug), {}),
+        ('api_user_posts', None, 'get', '/api/v1/users/{}/posts/'.format(author.username), {}),
+        ('api_follow_posts', reader, 'get', '/api/v1/follow/posts/', {}),
+    ]
+
+
+def default_routes():
+    """routes() по самым большим автору и группе в базе."""
+    post = Post.objects.select_related("author").order_by(
+        "-author__counters__post_count", "-comment_count", "-id"
+    ).first()
+    if post is None:
+        raise ValueError("В базе нет постов, сначала запустите seed_yatube")
+    follow = Follow.objects.select_related("user").filter(author=post.author).first()
+    reader = follow.user if follow else User.objects.exclude(pk=post.author_id).first()
+    stranger = User.objects.exclude(pk__in=[reader.pk, post.author_id]).exclude(following__user=reader).first()
+    group = Group.objects.annotate(posts=Count("group")).order_by("-posts").values_list("slug", flat=True).first()
+    return routes(post, reader, group or "missing", stranger or post.author)
+
+
+def isolated_caches():
+    """settings.CACHES, где L2 кэша по умолчанию - свой LocMem."""
+    default = dict(settings.CACHES["default"])
+    if default["BACKEND"] == "yatube.cache.TwoTierCache":
+        default["LOCATION"] = BENCH_ALIAS
+    else:
+        default = BENCH_CACHE
+    return {**settings.CACHES, "default": default, BENCH_ALIAS: BENCH_CACHE}
+
+
+def measure(client, route, repeat, cold=False):
+    name, user, method, url, data = route
+    request = getattr(client, method)
+    client.logout()
+    if user is not None:
+        client.force_login(user)
+
+    timings, queries = [], []
+    status = None
+    for _ in range(repeat):
+        if cold:
+            cache.clear()
+        with sqlaudit.audit() as report:
+            started = time.perf_counter()
+            status = request(url, data).status_code
+            timings.append(time.perf_counter() - started)
+        queries.append(report.count)
+
+    if cold:
+        cache.clear()
+    tracemalloc.start()
+    try:
+        request(url, data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "name": name, "user": user.username if user else None, "method": method, "url": url, "status": status,
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p95_ms": percentile(timings, 95) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "queries": sum(queries) / len(queries),
+        "max_queries": max(queries),
+        "peak_kb": peak / 1024,
+    }
+
+
+def run(repeat=50, cold=False, names=None, log=None):
+    """Замеряет маршруты и возвращает список результатов."""
+    log = log or (lambda result: None)
+    results = []
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"], CACHES=isolated_caches()):
+        try:
+            with transaction.atomic():
+                client = Client()
+                for route in default_routes():
+                    if names and route[0] not in names:
+                        continue
+                    result = measure(client, route, repeat, cold)
+                    log(result)
+                    results.append(result)
+                transaction.set_rollback(True)
+        finally:
+            # Поколения и кэш страниц видели откаченные записи
+            cache.clear()
+    return results
@@ -0,0 +1,56 @@
+"""Условные GET для лент и страницы поста.
+
+ETag собирается из поколений областей страницы (posts/generations.py),
+пользователя и адреса с параметрами, поэтому 304 отдаётся до
+построения запросов и шаблонов. Last-Modified отдаётся только
+анонимам: страница пользователя меняется и без изменения данных,
+например после входа, и её отличает только ETag. В ETag
+пользователя входит и его CSRF-cookie: после нового входа токен в
+форме комментария другой, и страница со старым не должна
+возвращаться по 304. У ответов с ошибкой (401, 404) валидаторов нет.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.views.decorators.http import condition
+
+from . import generations, surrogate
+
+
+def page_etag(request, scopes):
+    viewer = "anonymous"
+    if request.user.is_authenticated:
+        viewer = "{}:{}".format(request.user.pk, request.META.get("CSRF_COOKIE", ""))
+    raw = "|".join((
+        generations.current(*scopes), viewer, request.get_full_path(), settings.ETAG_SALT,
+    ))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def conditional_page(scopes):
+    """Декоратор: scopes(request, *args, **kwargs) - области страницы."""
+    def etag(request, *args, **kwargs):
+        return page_etag(request, scopes(request, *args, **kwargs))
+
+    def last_modified(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        return generations.changed(*scopes(request, *args, **kwargs))
+
+    def decorator(view):
+        view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if response.status_code >= 400:
+                # Ошибку клиент не должен переспрашивать по ETag и получать 304
+                del response["ETag"]
+                del response["Last-Modified"]
+            return surrogate.add_headers(request, response, scopes(request, *args, **kwargs))
+
+        # По областям страницы PageCacheMiddleware проверяет свой кэш
+        wrapper.page_scopes = scopes
+        return wrapper
+    return decorator
@@ -0,0 +1,102 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Post, Comment, Follow, UserCounters
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+
+def _count(queryset, field):
+    """Подзапрос COUNT(*) по полю field, связанному с внешним pk."""
+    counted = queryset.filter(
+        **{field: OuterRef("pk")}
+    ).order_by().values(field).annotate(total=Count("*")).values("total")
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def actual_user_counts(user_id):
+    return {
+        "post_count": Post.objects.filter(author_id=user_id).count(),
+        "following_count": Follow.objects.filter(author_id=user_id).count(),
+        "follower_count": Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def recount_user(user_id):
+    counters, _ = UserCounters.objects.update_or_create(
+        user_id=user_id, defaults=actual_user_counts(user_id)
+    )
+    return counters
+
+
+def counters_for(user):
+    try:
+        return user.counters
+    except UserCounters.DoesNotExist:
+        return recount_user(user.pk)
+
+
+def bump_user(user_id, field, delta):
+    updated = UserCounters.objects.filter(user_id=user_id).update(**{field: F(field) + delta})
+    # Строку создаём только при росте счётчика: при удалении пользователя
+    # каскадом его счётчики уже могут быть удалены
+    if not updated and delta > 0:
+        recount_user(user_id)
+
+
+def bump_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comment_count=F("comment_count") + delta, modified=timezone.now()
+    )
+
+
+def reconcile():
+    """Чинит разошедшиеся счётчики, возвращает число исправленных строк."""
+    fixed = 0
+
+    posts = Post.objects.annotate(
+        actual=_count(Comment.objects.all(), "post")
+    ).exclude(comment_count=F("actual")).only("id", "comment_count")
+    batch = []
+    now = timezone.now()
+    for post in posts.iterator():
+        post.comment_count = post.actual
+        # Карточки постов в кэше лежат по modified
+        post.modified = now
+        batch.append(post)
+    Post.objects.bulk_update(batch, ["comment_count", "modified"], batch_size=BATCH_SIZE)
+    fixed += len(batch)
+
+    users = User.objects.annotate(
+        actual_posts=_count(Post.objects.all(), "author"),
+        actual_following=_count(Follow.objects.all(), "author"),
+        actual_follower=_count(Follow.objects.all(), "user"),
+    ).values_list(
+        "pk", "actual_posts", "actual_following", "actual_follower",
+        "counters__post_count", "counters__following_count", "counters__follower_count",
+    )
+    to_update, to_create = [], []
+    for pk, *values in users.iterator():
+        actual, stored = values[:3], values[3:]
+        if actual == stored:
+            continue
+        counters = UserCounters(user_id=pk, post_count=actual[0],
+                                following_count=actual[1], follower_count=actual[2])
+        if stored[0] is None:
+            to_create.append(counters)
+        else:
+            to_update.append(counters)
+    UserCounters.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    UserCounters.objects.bulk_update(
+        to_update, ["post_count", "following_count", "follower_count"], batch_size=BATCH_SIZE
+    )
+    # authors импортирует этот модуль
+    from .authors import forget_ids
+    repaired = [counters.user_id for counters in to_create + to_update]
+    for start in range(0, len(repaired), BATCH_SIZE):
+        forget_ids(*repaired[start:start + BATCH_SIZE])
+    return fixed + len(to_create) + len(to_update)
@@ -0,0 +1,135 @@
+"""RSS и Atom: общая лента, лента группы и лента автора.
+
+В ленту попадают FEED_SIZE последних постов области, запрос идёт по
+тем же индексам (-pub_date, -id), что и HTML-ленты. ETag и
+Last-Modified берутся из поколений области (conditional_page), так что
+опрос без новых постов получает 304 без запросов к базе, а анонимный
+ответ целиком лежит в кэше страниц до следующего изменения области.
+"""
+from django.contrib.syndication.views import Feed
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.text import Truncator
+
+from . import generations
+from .authors import request_author
+from .conditional import conditional_page
+from .models import Group, Post
+
+FEED_SIZE = 20
+TITLE_LENGTH = 80
+FEED_FIELDS = ("id", "pub_date", "modified", "excerpt", "text_html", "author__username")
+
+
+class PostsFeed(Feed):
+    title = "Yatube: последние записи"
+    description = "Новые записи на Yatube"
+
+    def __call__(self, request, *args, **kwargs):
+        response = super().__call__(request, *args, **kwargs)
+        # Last-Modified ставит conditional_page по времени изменения
+        # области, иначе If-Modified-Since сверялся бы с другой датой
+        del response["Last-Modified"]
+        return response
+
+    def link(self, obj):
+        return reverse("index")
+
+    def posts(self, obj):
+        return Post.objects.all()
+
+    def items(self, obj):
+        return self.posts(obj).select_related("author").only(*FEED_FIELDS).order_by("-pub_date", "-id")[:FEED_SIZE]
+
+    def item_title(self, item):
+        return Truncator(item.excerpt).chars(TITLE_LENGTH)
+
+    def item_description(self, item):
+        return item.text_html
+
+    def item_link(self, item):
+        return reverse("post", args=(item.author.username, item.pk))
+
+    def item_author_name(self, item):
+        return item.author.username
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_updateddate(self, item):
+        return item.modified
+
+
+class GroupFeed(PostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group.objects.only("id", "title", "slug", "description"), slug=slug)
+
+    def title(self, obj):
+        return "Yatube: {}".format(obj.title)
+
+    def description(self, obj):
+        return obj.description
+
+    def link(self, obj):
+        return reverse("group", args=(obj.slug,))
+
+    def posts(self, obj):
+        return Post.objects.filter(group=obj.pk)
+
+
+class AuthorFeed(PostsFeed):
+    def get_object(self, request, username):
+        return request_author(request, username)
+
+    def title(self, obj):
+        return "Yatube: записи {}".format(obj.get_full_name() or obj.username)
+
+    def description(self, obj):
+        return self.title(obj)
+
+    def link(self, obj):
+        return reverse("profile", args=(obj.username,))
+
+    def posts(self, obj):
+        return Post.objects.filter(author=obj.pk)
+
+
+class AtomMixin:
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        # В Atom нет description, его место занимает subtitle
+        return self._get_dynamic_attr("description", obj)
+
+
+class PostsAtomFeed(AtomMixin, PostsFeed):
+    pass
+
+
+class GroupAtomFeed(AtomMixin, GroupFeed):
+    pass
+
+
+class AuthorAtomFeed(AtomMixin, AuthorFeed):
+    pass
+
+
+def _posts_scopes(request):
+    return [generations.INDEX]
+
+
+def _group_scopes(request, slug):
+    return [generations.group(slug)]
+
+
+def _author_scopes(request, username):
+    return [generations.author(request_author(request, username).pk)]
+
+
+posts_rss = conditional_page(_posts_scopes)(PostsFeed())
+posts_atom = conditional_page(_posts_scopes)(PostsAtomFeed())
+group_rss = conditional_page(_group_scopes)(GroupFeed())
+group_atom = conditional_page(_group_scopes)(GroupAtomFeed())
+author_rss = conditional_page(_author_scopes)(AuthorFeed())
+author_atom = conditional_page(_author_scopes)(AuthorAtomFeed())
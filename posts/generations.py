@@ -0,0 +1,73 @@
+"""Поколения содержимого для ключей кэша.
+
+Каждая область (лента, группа, автор) имеет счётчик в кэше. Запись
+в Post, Comment, Group или Follow увеличивает счётчики затронутых
+областей, а ключи фрагментов включают их текущие значения, поэтому
+устаревший HTML просто перестаёт находиться и вытесняется по TTL.
+Рядом хранится время последнего изменения области для Last-Modified.
+"""
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+
+INDEX = "index"
+GROUPS = "groups"
+KEY = "generation:{}"
+CHANGED_KEY = "generation:{}:changed"
+
+
+def group(slug):
+    return "group-{}".format(slug)
+
+
+def author(user_id):
+    return "author-{}".format(user_id)
+
+
+def post(post_id):
+    return "post-{}".format(post_id)
+
+
+def follow(user_id):
+    return "follow-{}".format(user_id)
+
+
+def _initial():
+    # Начинаем с отметки времени, чтобы после вытеснения ключа
+    # счётчик не повторил уже использованное значение
+    return int(time.time() * 1000)
+
+
+def current(*scopes):
+    """Строка из текущих поколений перечисленных областей."""
+    keys = [KEY.format(scope) for scope in scopes]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, _initial(), timeout=None)
+            values[key] = cache.get(key, _initial())
+    return ".".join(str(values[key]) for key in keys)
+
+
+def changed(*scopes):
+    """Время последнего изменения любой из областей (datetime в UTC)."""
+    keys = [CHANGED_KEY.format(scope) for scope in scopes]
+    stamps = cache.get_many(keys)
+    for key in keys:
+        if key not in stamps:
+            # Отметку вытеснили: считаем, что область изменилась сейчас
+            cache.add(key, time.time(), timeout=None)
+            stamps[key] = cache.get(key, time.time())
+    return datetime.fromtimestamp(max(stamps.values()), tz=timezone.utc)
+
+
+def bump(*scopes):
+    now = time.time()
+    for scope in set(scopes):
+        key = KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial(), timeout=None)
+        cache.set(CHANGED_KEY.format(scope), now, timeout=None)
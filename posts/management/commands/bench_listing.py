@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from posts.models import Post
+
+
+def fetch(queryset):
+    """Выполняет запрос курсором и возвращает (байт получено, секунд)."""
+    sql, params = queryset.query.sql_with_params()
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    elapsed = time.perf_counter() - started
+    size = sum(len(str(value).encode()) for row in rows for value in row if value is not None)
+    return size, elapsed
+
+
+class Command(BaseCommand):
+    help = "Сравнивает полную выборку постов для лент с выборкой for_listing()"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=5, help="сколько страниц ленты читать")
+        parser.add_argument("--per-page", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        variants = (
+            ("select_related()", Post.objects.select_related()),
+            ("for_listing()", Post.objects.for_listing()),
+        )
+        per_page = options["per_page"]
+        self.stdout.write("{:<18} {:>14} {:>14}".format("queryset", "bytes/page", "ms/page"))
+        for name, queryset in variants:
+            queryset = queryset.order_by("-pub_date", "-id")
+            total_bytes = total_time = 0
+            for _ in range(options["repeat"]):
+                for page in range(options["pages"]):
+                    size, elapsed = fetch(queryset[page * per_page:(page + 1) * per_page])
+                    total_bytes += size
+                    total_time += elapsed
+            pages = options["repeat"] * options["pages"]
+            self.stdout.write("{:<18} {:>14.0f} {:>14.3f}".format(
+                name, total_bytes / pages, total_time / pages * 1000
+            ))
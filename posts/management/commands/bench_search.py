@@ -0,0 +1,77 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts import counters, search
+from posts.models import Post
+from posts.seed import VOCABULARY, WEIGHTS
+
+User = get_user_model()
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = "Сравнивает поиск по индексу с перебором text__icontains"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=1000000,
+                            help="сколько постов должно быть в базе с --seed")
+        parser.add_argument("--seed", action="store_true",
+                            help="досоздать синтетические посты до --posts и пересобрать индекс")
+        parser.add_argument("--query", action="append",
+                            help="поисковый запрос, можно несколько раз")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def seed(self, total):
+        author, _ = User.objects.get_or_create(username="bench_search")
+        missing = total - Post.objects.count()
+        while missing > 0:
+            size = min(missing, search.BATCH_SIZE)
+            posts = []
+            for _ in range(size):
+                text = " ".join(random.choices(VOCABULARY, WEIGHTS, k=random.randint(10, 60)))
+                posts.append(Post(text=text, text_html=text, excerpt=text[:300],
+                                  word_count=len(text.split()), author=author))
+            # bulk_create не шлёт сигналов: индекс и счётчики поправим в конце
+            Post.objects.bulk_create(posts)
+            missing -= size
+            self.stdout.write("Осталось создать: {}".format(missing))
+        self.stdout.write("Индексирование...")
+        search.rebuild()
+        counters.reconcile()
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            self.seed(options["posts"])
+
+        queries = options["query"] or [
+            VOCABULARY[10], VOCABULARY[200], "{} {}".format(VOCABULARY[5], VOCABULARY[50]),
+        ]
+        self.stdout.write("{} постов".format(Post.objects.count()))
+        self.stdout.write("{:<24} {:>12} {:>12}".format("запрос", "icontains, ms", "индекс, ms"))
+        for query in queries:
+            def scan():
+                matches = Post.objects.all()
+                for term in search.query_terms(query):
+                    matches = matches.filter(text__icontains=term)
+                matches.count()
+                list(matches.order_by("-pub_date", "-id").values_list("id", flat=True)[:10])
+
+            def indexed():
+                results = search.search(query)
+                results.count()
+                list(results[:10])
+
+            repeat = options["repeat"]
+            scan_time = sum(timed(scan) for _ in range(repeat)) / repeat
+            index_time = sum(timed(indexed) for _ in range(repeat)) / repeat
+            self.stdout.write("{:<24} {:>12.1f} {:>12.1f}".format(
+                query, scan_time * 1000, index_time * 1000
+            ))
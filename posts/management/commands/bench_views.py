@@ -0,0 +1,59 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark
+
+ROW = "{:<18} {:<14} {:>8} {:>8} {:>8} {:>8} {:>9}"
+
+
+def label(result):
+    return "{} {}".format(result["name"], result["user"] or "anon")
+
+
+class Command(BaseCommand):
+    help = "Замеряет все маршруты тестовым клиентом: p50/p95/p99, запросы к базе, память"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--cold", action="store_true", help="очищать кэш перед каждым запросом")
+        parser.add_argument("--route", action="append", dest="routes", help="имя URL, можно несколько раз")
+        parser.add_argument("--output", help="файл JSON с результатами, по умолчанию bench-<время>.json")
+        parser.add_argument("--compare", help="JSON прошлого запуска для сравнения p95 и запросов")
+
+    def handle(self, *args, **options):
+        previous = {}
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as stream:
+                previous = {label(result): result for result in json.load(stream)["results"]}
+
+        self.stdout.write(ROW.format("маршрут", "пользователь", "p50, ms", "p95, ms", "p99, ms", "запросы", "пик, КБ"))
+
+        def log(result):
+            self.stdout.write(ROW.format(
+                result["name"], result["user"] or "-", "{:.1f}".format(result["p50_ms"]),
+                "{:.1f}".format(result["p95_ms"]), "{:.1f}".format(result["p99_ms"]),
+                "{:.1f}".format(result["queries"]), "{:.0f}".format(result["peak_kb"]),
+            ))
+            old = previous.get(label(result))
+            if old:
+                self.stdout.write("{:<33} p95 {:+.1f} ms, запросы {:+.1f}, память {:+.0f} КБ".format(
+                    "", result["p95_ms"] - old["p95_ms"], result["queries"] - old["queries"],
+                    result["peak_kb"] - old["peak_kb"],
+                ))
+
+        try:
+            results = benchmark.run(options["repeat"], options["cold"], options["routes"], log)
+        except ValueError as error:
+            raise CommandError(error)
+
+        path = options["output"] or time.strftime("bench-%Y%m%d-%H%M%S.json")
+        with open(path, "w", encoding="utf-8") as stream:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "repeat": options["repeat"],
+                "cold": options["cold"],
+                "results": results,
+            }, stream, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS("Результаты сохранены в {}".format(path)))
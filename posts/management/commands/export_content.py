@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = "Выгружает группы, пользователей, посты, комментарии и подписки в JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="-", help="файл, по умолчанию stdout")
+        parser.add_argument("--chunk-size", type=int, default=transfer.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options["path"] == "-":
+            counts = transfer.export(self.stdout, options["chunk_size"])
+            # stdout занят данными, отчёт пишем в stderr
+            report = self.stderr
+        else:
+            with open(options["path"], "w", encoding="utf-8") as stream:
+                counts = transfer.export(stream, options["chunk_size"])
+            report = self.stdout
+        total = sum(counts.values())
+        for model, count in counts.items():
+            report.write("{}: {}".format(model, count))
+        report.write("Выгружено строк: {}, {:.0f} строк/с".format(total, transfer.rate(total, started)))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = "Воркер: заранее создаёт миниатюры картинок постов из очереди"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument("--once", action="store_true", help="обработать очередь и выйти")
+        parser.add_argument("--sleep", type=float, default=2.0, help="пауза, когда очередь пуста")
+        parser.add_argument("--missing", action="store_true",
+                            help="поставить в очередь все посты с картинкой без миниатюр")
+
+    def handle(self, *args, **options):
+        if options["missing"]:
+            posts = Post.objects.exclude(image="").exclude(image=None).filter(thumbnail_url="")
+            for post in posts.only("pk").iterator():
+                thumbnails.enqueue(post)
+
+        while True:
+            done, failed = thumbnails.process(options["batch_size"])
+            if done or failed:
+                self.stdout.write("Готово: {}, с ошибкой: {}".format(done, failed))
+            elif options["once"]:
+                return
+            else:
+                time.sleep(options["sleep"])
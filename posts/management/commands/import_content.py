@@ -0,0 +1,48 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import transfer
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Загружает JSONL из export_content"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="-", help="файл, по умолчанию stdin")
+        parser.add_argument("--batch-size", type=int, default=transfer.BATCH_SIZE)
+        parser.add_argument("--drop-indexes", action="store_true",
+                            help="снять индексы постов и комментариев на время загрузки")
+        parser.add_argument("--no-rebuild", action="store_true",
+                            help="не пересчитывать счётчики, ленты и поиск после загрузки")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            stream = sys.stdin if options["path"] == "-" else open(options["path"], encoding="utf-8")
+        except OSError as error:
+            raise CommandError("Не удалось открыть {}: {}".format(options["path"], error))
+        try:
+            if options["drop_indexes"]:
+                with transfer.without_indexes(Post, Comment):
+                    counts = transfer.load(stream, options["batch_size"])
+            else:
+                counts = transfer.load(stream, options["batch_size"])
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        total = sum(counts.values())
+        for model, count in counts.items():
+            self.stdout.write("{}: {}".format(model, count))
+        self.stdout.write("Загружено строк: {}, {:.0f} строк/с".format(total, transfer.rate(total, started)))
+
+        if not options["no_rebuild"]:
+            rebuild_started = time.perf_counter()
+            transfer.rebuild()
+            self.stdout.write("Счётчики, ленты и поиск пересобраны за {:.1f} с".format(
+                time.perf_counter() - rebuild_started
+            ))
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import surrogate
+
+
+class Command(BaseCommand):
+    help = "Воркер: отправляет очередь очистки кэша прокси на CDN_PURGE_URL"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--once", action="store_true", help="обработать очередь и выйти")
+        parser.add_argument("--sleep", type=float, default=1.0, help="пауза, когда очередь пуста")
+
+    def handle(self, *args, **options):
+        if not settings.CDN_PURGE_URL:
+            raise CommandError("Не задан CDN_PURGE_URL")
+
+        while True:
+            sent, failed = surrogate.process(options["batch_size"])
+            if sent:
+                self.stdout.write("Очищено ключей: {}".format(sent))
+            if failed:
+                self.stderr.write("Не удалось отправить: {}".format(failed))
+            if options["once"] and not sent:
+                return
+            if not sent:
+                time.sleep(options["sleep"])
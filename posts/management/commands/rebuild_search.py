@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = "Пересобирает поисковый индекс постов и комментариев"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=search.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        count = search.rebuild(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS("Проиндексировано постов: {}".format(count)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = "Пересобирает ленты подписок из таблиц Follow и Post"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="users",
+                            help="id пользователя, можно указать несколько раз")
+
+    def handle(self, *args, **options):
+        count = timeline.rebuild(options["users"])
+        self.stdout.write(self.style.SUCCESS("Пересобрано подписок: {}".format(count)))
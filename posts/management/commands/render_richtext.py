@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts import richtext
+from posts.models import Post, Comment
+
+
+class Command(BaseCommand):
+    help = "Очищает и заранее рендерит текст постов и комментариев порциями"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--all", action="store_true",
+                            help="перерендерить и уже обработанные записи")
+
+    def backfill(self, queryset, render, fields, chunk_size):
+        done = last_pk = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk).order_by("pk")[:chunk_size])
+            if not chunk:
+                return done
+            for obj in chunk:
+                render(obj)
+            queryset.model.objects.bulk_update(chunk, fields)
+            done += len(chunk)
+            last_pk = chunk[-1].pk
+            self.stdout.write("{}: {}".format(queryset.model.__name__, done))
+
+    def handle(self, *args, **options):
+        posts = Post.objects.only("pk", "text")
+        comments = Comment.objects.only("pk", "text")
+        if not options["all"]:
+            posts = posts.filter(text_html="")
+            comments = comments.filter(text_html="")
+
+        def render_post(post):
+            richtext.render_post(post)
+            # Карточки в кэше привязаны к modified
+            post.modified = timezone.now()
+
+        post_count = self.backfill(posts, render_post, ["text_html", "excerpt", "word_count", "modified"],
+                                   options["chunk_size"])
+        comment_count = self.backfill(comments, richtext.render_comment, ["text_html"], options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(
+            "Обработано постов: {}, комментариев: {}".format(post_count, comment_count)
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import outbox
+
+
+class Command(BaseCommand):
+    help = "Воркер: выполняет отложенную работу из очереди OutboxMessage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--once", action="store_true", help="обработать очередь и выйти")
+        parser.add_argument("--sleep", type=float, default=1.0, help="пауза, когда очередь пуста")
+        parser.add_argument("--requeue-dead", action="store_true",
+                            help="вернуть в очередь сообщения, исчерпавшие попытки")
+
+    def handle(self, *args, **options):
+        if options["requeue_dead"]:
+            self.stdout.write("Возвращено в очередь: {}".format(outbox.requeue_dead()))
+
+        while True:
+            done, failed = outbox.process(options["batch_size"])
+            if done or failed:
+                self.stdout.write("Готово: {}, с ошибкой: {}".format(done, failed))
+            elif options["once"]:
+                return
+            else:
+                time.sleep(options["sleep"])
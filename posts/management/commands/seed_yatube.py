@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from posts import seed
+
+
+class Command(BaseCommand):
+    help = "Заполняет базу синтетическими пользователями, группами, постами, комментариями и подписками"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--groups", type=int, default=20)
+        parser.add_argument("--posts", type=int, default=20000)
+        parser.add_argument("--comments", type=int, default=50000)
+        parser.add_argument("--follows", type=int, default=20, help="среднее число подписок на пользователя")
+        parser.add_argument("--images", type=float, default=0.0, help="доля постов с картинкой, от 0 до 1")
+        parser.add_argument("--random-seed", type=int, help="для повторяемых данных")
+
+    def handle(self, *args, **options):
+        counts = seed.seed(
+            users=options["users"], groups=options["groups"], posts=options["posts"],
+            comments=options["comments"], follows=options["follows"], images=options["images"],
+            random_seed=options["random_seed"], log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS("Создано: {}".format(
+            ", ".join("{} {}".format(model, count) for model, count in counts.items())
+        )))
+        self.stdout.write("Пароль пользователей {}_user*: {}".format(seed.PREFIX, seed.SEED_PASSWORD))
@@ -0,0 +1,114 @@
+import cProfile
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import generations, pagecache, profiling, slowlog, sqlaudit, thumbnails
+
+logger = logging.getLogger("posts.sqlaudit")
+
+
+class ProfilingMiddleware:
+    """Время запроса, SQL, шаблонов и кэша в заголовке Server-Timing,
+    сводка по view и выборочные профили cProfile, см. posts/profiling.py.
+    Туда же - число миниатюр и обращений за ними (posts/thumbnails.py).
+    Заголовок видит только персонал: по нему видно, что и сколько
+    стоит на сервере.
+
+    Включается настройкой PROFILING.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = cProfile.Profile() if profiling.sampled() else None
+        # Счётчики миниатюр живут в потоке, а поток обслуживает много запросов
+        thumbnails.reset_stats()
+        with profiling.profiled() as timings:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        match = request.resolver_match
+        view_name = match.view_name if match else "unresolved"
+        profiling.record(view_name, timings)
+        if profiler is not None:
+            profiling.dump(profiler, view_name)
+        user = getattr(request, "user", None)
+        if user is not None and user.is_staff:
+            response["Server-Timing"] = '{}, thumbnails;desc="{thumbnails} thumbnails in {lookups} lookups"'.format(
+                timings.server_timing(), **thumbnails.get_stats()
+            )
+        return response
+
+
+class SlowQueryViewMiddleware:
+    """Подписывает записи журнала медленных запросов именем view."""
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_LOG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = slowlog.current_view.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            slowlog.current_view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        slowlog.current_view.set(request.resolver_match.view_name)
+
+
+class QueryAuditMiddleware:
+    """Считает запросы страницы и пишет в лог превышения бюджета и N+1.
+
+    Включается настройкой QUERY_AUDIT, число запросов отдаётся
+    в заголовке X-Query-Count.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_AUDIT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with sqlaudit.audit() as report:
+            response = self.get_response(request)
+        match = request.resolver_match
+        for problem in report.problems(match.url_name if match else None):
+            logger.warning("%s %s", request.path, problem)
+        response["X-Query-Count"] = str(report.count)
+        return response
+
+
+class PageCacheMiddleware:
+    """Отдаёт анонимам страницы из кэша, см. posts/pagecache.py."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        generation = getattr(request, "page_cache_generation", None)
+        if generation is not None:
+            pagecache.store(request, response, generation)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        scopes = getattr(view_func, "page_scopes", None)
+        if scopes is None or not pagecache.is_cacheable_request(request):
+            return None
+        generation = generations.current(*scopes(request, *view_args, **view_kwargs))
+        response = pagecache.fetch(request, generation)
+        if response is None:
+            request.page_cache_generation = generation
+        return response
@@ -0,0 +1,189 @@
+# Generated by Django 2.2.13 on 2026-10-18 04:43
+
+import re
+from html import escape
+from html.parser import HTMLParser
+
+from django.db import migrations, models
+from django.utils.html import linebreaks
+from django.utils.text import Truncator
+
+BATCH_SIZE = 1000
+
+# Копия posts/richtext.py на момент миграции: дальнейшие правки
+# очистки не должны менять то, что делает эта миграция
+ALLOWED_TAGS = {
+    "p", "br", "strong", "b", "em", "i", "u", "a",
+    "h1", "h2", "h3", "h4", "h5", "h6", "pre", "address", "div",
+    "ol", "ul", "li", "hr", "blockquote", "span",
+}
+VOID_TAGS = {"br", "hr"}
+BLOCK_TAGS = {
+    "p", "br", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "address",
+    "div", "li", "hr", "blockquote",
+}
+# Содержимое этих тегов выбрасывается целиком
+DROP_CONTENT_TAGS = {"script", "style", "iframe", "object", "embed", "template"}
+ALLOWED_ATTRS = {
+    "a": {"href", "title", "target"},
+}
+GLOBAL_ATTRS = {"style"}
+ALLOWED_STYLES = {"color", "text-align", "margin-left"}
+STYLE_VALUE = re.compile(r"^[#\w\s.,%()-]+$")
+ALLOWED_SCHEMES = {"http", "https", "mailto"}
+
+EXCERPT_LENGTH = 300
+
+
+def _clean_style(value):
+    declarations = []
+    for declaration in value.split(";"):
+        name, _, css = declaration.partition(":")
+        name, css = name.strip().lower(), css.strip()
+        if name in ALLOWED_STYLES and STYLE_VALUE.match(css) and "url" not in css.lower() \
+                and "expression" not in css.lower():
+            declarations.append("{}: {}".format(name, css))
+    return "; ".join(declarations)
+
+
+def _clean_href(value):
+    value = value.strip()
+    scheme, colon, _ = value.partition(":")
+    if colon and "/" not in scheme and scheme.lower() not in ALLOWED_SCHEMES:
+        return None
+    return value
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.stack = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append("\n")
+
+        cleaned = []
+        for name, value in attrs:
+            if value is None or (name not in GLOBAL_ATTRS and name not in ALLOWED_ATTRS.get(tag, ())):
+                continue
+            if name == "style":
+                value = _clean_style(value)
+            elif name == "href":
+                value = _clean_href(value)
+            if value:
+                cleaned.append(' {}="{}"'.format(name, escape(value)))
+        if tag == "a" and any(name == "target" for name, _ in attrs):
+            cleaned.append(' rel="noopener noreferrer"')
+
+        self.html.append("<{}{}>".format(tag, "".join(cleaned)))
+        if tag not in VOID_TAGS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.stack and self.stack[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.stack:
+            return
+        # Закрываем всё, что осталось открытым внутри этого тега
+        while self.stack:
+            opened = self.stack.pop()
+            self.html.append("</{}>".format(opened))
+            if opened == tag:
+                break
+        if tag in BLOCK_TAGS:
+            self.text.append("\n")
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def result(self):
+        self.close()
+        while self.stack:
+            self.html.append("</{}>".format(self.stack.pop()))
+        return "".join(self.html), " ".join("".join(self.text).split())
+
+
+def sanitize(html):
+    """Возвращает (очищенный HTML, простой текст)."""
+    parser = _Sanitizer()
+    parser.feed(html or "")
+    return parser.result()
+
+
+def render_post(post):
+    post.text_html, text = sanitize(post.text)
+    post.excerpt = Truncator(text).chars(EXCERPT_LENGTH)
+    post.word_count = len(text.split())
+
+
+def render_comment(comment):
+    text_html, _ = sanitize(comment.text)
+    comment.text_html = linebreaks(text_html)
+
+
+
+def render_existing(apps, schema_editor):
+    # Иначе у старых постов и комментариев в лентах пустой текст
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    for model, render, fields in (
+        (Post, render_post, ['text_html', 'excerpt', 'word_count']),
+        (Comment, render_comment, ['text_html']),
+    ):
+        batch = []
+        for item in model.objects.only('id', 'text').iterator():
+            render(item)
+            batch.append(item)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, fields)
+                batch = []
+        model.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_post_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='text_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=300),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='text_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(render_existing, migrations.RunPython.noop),
+    ]
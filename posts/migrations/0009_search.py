@@ -0,0 +1,50 @@
+# Generated by Django 2.2.13 on 2026-10-18 04:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# На PostgreSQL поиск идёт по tsvector, таблица SearchToken пустует.
+# Существующие посты индексирует команда rebuild_search.
+SEARCH_VECTOR = """
+    ALTER TABLE posts_post ADD COLUMN search_vector tsvector;
+    CREATE INDEX posts_post_search_vector_idx ON posts_post USING GIN (search_vector);
+"""
+DROP_SEARCH_VECTOR = """
+    DROP INDEX IF EXISTS posts_post_search_vector_idx;
+    ALTER TABLE posts_post DROP COLUMN IF EXISTS search_vector;
+"""
+
+
+def add_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(SEARCH_VECTOR)
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_SEARCH_VECTOR)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='posts.Comment')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='posts.Post')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['token', 'post'], name='posts_searc_token_958253_idx'),
+        ),
+        migrations.RunPython(add_search_vector, drop_search_vector),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from ckeditor.fields import RichTextField
 
@@ -26,22 +27,154 @@ class Group(models.Model):
         return str(self.title)
 
 
+class PostQuerySet(models.QuerySet):
+    # Поля, которые выводит карточка поста в лентах (post_item.html)
+    LISTING_FIELDS = (
+        "id", "pub_date", "modified", "excerpt", "image", "thumbnail_url", "thumbnail_srcset", "comment_count",
+        "author_id", "author__username", "group_id", "group__slug", "group__title",
+    )
+
+    def for_listing(self):
+        return self.select_related("author", "group").only(*self.LISTING_FIELDS)
+
+
 class Post(models.Model):
     text = RichTextField()
+    # Заполняются из text при сохранении, см. posts/richtext.py
+    text_html = models.TextField(blank=True, editable=False)
+    excerpt = models.CharField(max_length=300, blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
     pub_date = models.DateTimeField(verbose_name="Дата публикации", auto_now_add=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="author", db_index=True)
     group = models.ForeignKey(Group, on_delete=models.SET_NULL, related_name="group", blank=True, null=True,
                               db_index=True)
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # Меняется при любом изменении карточки поста, входит в ключ её кэша
+    modified = models.DateTimeField(auto_now=True)
+    # Заполняются воркером generate_thumbnails, пока пусто - показываем оригинал
+    thumbnail_url = models.CharField(max_length=255, blank=True, editable=False)
+    thumbnail_srcset = models.TextField(blank=True, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        # Ленты всегда сортируются по ("-pub_date", "-id")
+        indexes = [
+            models.Index(fields=['author', '-pub_date', '-id']),
+            models.Index(fields=['group', '-pub_date', '-id']),
+            models.Index(fields=['-pub_date', '-id']),
+        ]
 
     def __str__(self):
         return str(self.id)
 
 class Comment(models.Model):
     text = RichTextField()
+    text_html = models.TextField(blank=True, editable=False)
     created = models.DateTimeField(verbose_name='Дата публикации', auto_now_add=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='author_comment', db_index=True)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comment_post', db_index=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['post', 'created', 'id'])]
+
     def __str__(self):
         return str(self.text)
+
+
+class UserCounters(models.Model):
+    """Счётчики пользователя, обновляются сигналами Post и Follow."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="counters")
+    post_count = models.PositiveIntegerField(default=0)
+    # Имена как у related_name в Follow: following - подписчики автора,
+    # follower - на кого подписан сам пользователь
+    following_count = models.PositiveIntegerField(default=0)
+    follower_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class TimelineEntry(models.Model):
+    """Запись в ленте подписчика: заполняется при публикации поста."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['user', 'post']
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-id']),
+            models.Index(fields=['user', 'author']),
+        ]
+
+    def __str__(self):
+        return str(self.id)
+
+
+class ThumbnailJob(models.Model):
+    """Очередь на генерацию миниатюр картинки поста."""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name="thumbnail_job")
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # После ошибки следующая попытка откладывается (outbox.backoff)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return str(self.post_id)
+
+
+class PurgeRequest(models.Model):
+    """Очередь очистки кэша прокси по суррогатному ключу.
+
+    Один ключ может стоять в очереди несколько раз: воркер склеивает
+    повторы и удаляет ровно те строки, которые отправил.
+    """
+    key = models.CharField(max_length=200)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.key
+
+
+class OutboxMessage(models.Model):
+    """Отложенная работа (письма и т.п.), записанная в одной транзакции
+    с изменением, которое её породило. Разбирает воркер run_outbox."""
+    kind = models.CharField(max_length=50)
+    payload = models.TextField(default="{}")
+    created = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    dead = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [models.Index(fields=["dead", "available_at", "id"])]
+
+    def __str__(self):
+        return "{} #{}".format(self.kind, self.pk)
+
+
+class SearchToken(models.Model):
+    """Обратный индекс для поиска на SQLite (в PostgreSQL - tsvector).
+
+    Строка на каждое слово текста поста (comment пустой) или его
+    комментария, weight - сколько раз слово встретилось с учётом веса
+    источника.
+    """
+    token = models.CharField(max_length=64)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="search_tokens")
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name="search_tokens",
+                                blank=True, null=True)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['token', 'post'])]
+
+    def __str__(self):
+        return self.token
@@ -0,0 +1,112 @@
+"""Очередь отложенной работы в базе (transactional outbox).
+
+enqueue() пишет OutboxMessage в текущей транзакции, поэтому сообщение
+появляется, только если изменение, которое его породило, сохранилось.
+Воркер run_outbox разбирает очередь пачками: одно почтовое соединение
+на пачку, ошибка откладывает сообщение с растущей паузой, после
+MAX_ATTEMPTS попыток оно помечается dead и ждёт разбора вручную.
+
+Обработчики регистрируются декоратором handler(kind) в модуле
+<app>/outbox.py, такие модули загружаются при старте (PostsConfig).
+"""
+import json
+import logging
+from datetime import timedelta
+
+from django.core import mail
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+BASE_DELAY = 30
+MAX_DELAY = 60 * 60
+# Столько сообщение считается занятым воркером, который его взял
+LEASE = 5 * 60
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Декоратор: func(payload, connection) обрабатывает сообщения kind.
+
+    connection - открытое на всю пачку почтовое соединение.
+    """
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, **payload):
+    if kind not in HANDLERS:
+        raise ValueError("Нет обработчика для {}".format(kind))
+    return OutboxMessage.objects.create(kind=kind, payload=json.dumps(payload))
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(BASE_DELAY * 2 ** (attempts - 1), MAX_DELAY))
+
+
+def _claim(batch_size):
+    """Берёт пачку готовых сообщений и продлевает их available_at на LEASE,
+    чтобы параллельный воркер их не взял."""
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(OutboxMessage.objects.select_for_update(skip_locked=True).filter(
+            dead=False, available_at__lte=now,
+        ).order_by("available_at", "id")[:batch_size])
+        OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).update(
+            available_at=now + timedelta(seconds=LEASE)
+        )
+    return messages
+
+
+def _fail(message, error):
+    attempts = message.attempts + 1
+    dead = attempts >= MAX_ATTEMPTS or message.kind not in HANDLERS
+    OutboxMessage.objects.filter(pk=message.pk).update(
+        attempts=F("attempts") + 1, last_error=str(error), dead=dead,
+        available_at=timezone.now() + backoff(attempts),
+    )
+    if dead:
+        logger.error("outbox: %s отложено окончательно: %s", message, error)
+
+
+def process(batch_size=50):
+    """Обрабатывает одну пачку, возвращает (выполнено, с ошибкой)."""
+    messages = _claim(batch_size)
+    if not messages:
+        return 0, 0
+    done = failed = 0
+    connection = mail.get_connection()
+    connection.open()
+    try:
+        for message in messages:
+            try:
+                func = HANDLERS.get(message.kind)
+                if func is None:
+                    raise LookupError("Нет обработчика для {}".format(message.kind))
+                func(json.loads(message.payload), connection)
+            except Exception as error:  # обработчики бывают любыми, очередь не должна вставать
+                _fail(message, error)
+                failed += 1
+                # После ошибки SMTP соединение могло сломаться: следующее
+                # письмо откроет новое
+                connection.close()
+                continue
+            OutboxMessage.objects.filter(pk=message.pk).delete()
+            done += 1
+    finally:
+        connection.close()
+    return done, failed
+
+
+def requeue_dead():
+    return OutboxMessage.objects.filter(dead=True).update(
+        dead=False, attempts=0, available_at=timezone.now()
+    )
@@ -0,0 +1,107 @@
+"""Кэш целых страниц для анонимных читателей.
+
+Кэшируются только view с conditional_page (posts/conditional.py): их
+области (scopes) служат тегами записи. Запись хранит поколения своих
+областей на момент рендера и при чтении сверяется с текущими, так
+что изменение поста, комментария, группы или подписки в области
+сразу делает её страницы недействительными, а остальные не трогает.
+
+В кэш попадают только ответы 200 без cookie и без CSRF-токена
+на запросы без cookie сессии. Статистика попаданий считается в
+памяти процесса, чтобы попадание не стоило лишних записей в кэш.
+"""
+import hashlib
+import os
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+KEY = "page:{}"
+STATS = ("hits", "misses", "stores", "bytes_served")
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Vary", "Cache-Control", "Surrogate-Key")
+
+_stats = Counter()
+_lock = threading.Lock()
+
+
+def _incr(name, delta=1):
+    with _lock:
+        _stats[name] += delta
+
+
+def stats():
+    """Счётчики этого процесса."""
+    with _lock:
+        result = {name: _stats[name] for name in STATS}
+    requests = result["hits"] + result["misses"]
+    result["hit_ratio"] = round(result["hits"] / requests, 4) if requests else None
+    result["pid"] = os.getpid()
+    return result
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def page_key(request):
+    return KEY.format(hashlib.md5(request.get_full_path().encode()).hexdigest())
+
+
+def is_cacheable_request(request):
+    return request.method in ("GET", "HEAD") and settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def fetch(request, generation):
+    """Ответ из кэша или None, если записи нет или её области менялись.
+
+    generation - generations.current() областей страницы.
+    """
+    entry = cache.get(page_key(request))
+    if entry is None or entry["generation"] != generation:
+        _incr("misses")
+        return None
+
+    response = HttpResponse(entry["content"], status=entry["status"])
+    for name, value in entry["headers"].items():
+        response[name] = value
+    response["X-Page-Cache"] = "hit"
+    _incr("hits")
+    _incr("bytes_served", len(entry["content"]))
+    return get_conditional_response(
+        request,
+        etag=response.get("ETag"),
+        last_modified=parse_http_date_safe(response.get("Last-Modified", "")),
+        response=response,
+    )
+
+
+def is_public(request, response):
+    """Ответ одинаков для всех анонимов и его можно отдавать из кэша."""
+    return (
+        is_cacheable_request(request) and response.status_code == 200 and not response.streaming
+        and not response.cookies and not request.META.get("CSRF_COOKIE_USED")
+        and not request.user.is_authenticated and "private" not in response.get("Cache-Control", "")
+    )
+
+
+def store(request, response, generation):
+    # generation прочитано до рендера: если области поменялись во время
+    # него, запись просто не совпадёт при следующем чтении
+    if request.method != "GET" or not is_public(request, response):
+        # fetch() промахнулся и взял блокировку: записи не будет
+        cache.delete(page_key(request))
+        return False
+    cache.set(page_key(request), {
+        "generation": generation,
+        "status": response.status_code,
+        "headers": {name: response[name] for name in STORED_HEADERS if response.has_header(name)},
+        "content": response.content,
+    }, settings.PAGE_CACHE_TIMEOUT)
+    _incr("stores")
+    return True
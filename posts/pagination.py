@@ -0,0 +1,156 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(stamp, pk):
+    raw = "{}|{}".format(stamp.isoformat(), pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Возвращает пару (дата, id) из токена или None, если токен битый."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        stamp, pk = raw.split("|")
+        stamp = parse_datetime(stamp)
+        pk = int(pk)
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        return None
+    if stamp is None:
+        return None
+    return stamp, pk
+
+
+class CursorPage:
+    """Страница ленты с курсорами вместо номеров.
+
+    Повторяет ту часть интерфейса django.core.paginator.Page,
+    которой пользуются шаблоны.
+    """
+
+    def __init__(self, object_list, paginator, cursor=None,
+                 next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return "<CursorPage {}>".format(self.number)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    @property
+    def number(self):
+        # Используется в ключах кэша: первая страница всегда 1
+        return self.cursor or 1
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Пагинация по ключу (ordering[0], ordering[1]) без COUNT и OFFSET.
+
+    Оба поля сортировки должны идти в одном направлении, второе
+    поле (обычно id) делает ключ уникальным.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=("-pub_date", "-id")):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.descending = self.ordering[0].startswith("-")
+        self.fields = tuple(name.lstrip("-") for name in self.ordering)
+
+    def position(self, obj):
+        if isinstance(obj, dict):
+            return obj[self.fields[0]], obj[self.fields[1]]
+        return getattr(obj, self.fields[0]), getattr(obj, self.fields[1])
+
+    def cursor_for(self, obj):
+        return encode_cursor(*self.position(obj))
+
+    def _seek(self, position, forward):
+        stamp, pk = position
+        lookup = "lt" if self.descending == forward else "gt"
+        first, second = self.fields
+        return (
+            Q(**{"{}__{}".format(first, lookup): stamp})
+            | Q(**{first: stamp, "{}__{}".format(second, lookup): pk})
+        )
+
+    def _reversed_ordering(self):
+        return tuple(
+            name[1:] if name.startswith("-") else "-" + name
+            for name in self.ordering
+        )
+
+    def get_page(self, after=None, before=None):
+        token = before or after
+        position = decode_cursor(token) if token else None
+        backwards = position is not None and bool(before)
+
+        queryset = self.object_list
+        if position is None:
+            token = None
+            queryset = queryset.order_by(*self.ordering)
+        elif backwards:
+            queryset = queryset.filter(
+                self._seek(position, forward=False)
+            ).order_by(*self._reversed_ordering())
+        else:
+            queryset = queryset.filter(
+                self._seek(position, forward=True)
+            ).order_by(*self.ordering)
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or backwards:
+                next_cursor = self.cursor_for(rows[-1])
+            if (has_more and backwards) or (position is not None and not backwards):
+                previous_cursor = self.cursor_for(rows[0])
+        return CursorPage(rows, self, token, next_cursor, previous_cursor)
+
+
+def paginate(request, object_list, per_page):
+    """Возвращает (page, paginator) для ленты.
+
+    Курсорный режим включается настройкой FEED_PAGINATION = "cursor"
+    или параметром ?after= / ?before= в запросе, иначе работает
+    обычный Paginator с номерами страниц.
+    """
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+    if settings.FEED_PAGINATION == "cursor" or after or before:
+        paginator = CursorPaginator(object_list, per_page)
+        return paginator.get_page(after=after, before=before), paginator
+
+    paginator = Paginator(object_list, per_page)
+    return paginator.get_page(request.GET.get("page")), paginator
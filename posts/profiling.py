@@ -0,0 +1,168 @@
+"""Профиль запроса: общее время, SQL, шаблоны и кэш.
+
+ProfilingMiddleware заводит на запрос Timings и отдаёт их персоналу в
+заголовке Server-Timing (видно во вкладке Network браузера). SQL считается
+execute_wrapper, шаблоны - бэкендом TimedDjangoTemplates, кэш - по
+вызовам L2 из yatube/cache.py. Вложенные замеры одного вида
+(render_to_string внутри шаблона) не складываются дважды.
+
+По каждой view в памяти процесса хранятся последние WINDOW замеров,
+сводка по ним - в /panel/stats/. Доля PROFILE_SAMPLE_RATE запросов
+проходит через cProfile, файлы .prof пишутся в PROFILE_DIR.
+"""
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+WINDOW = 500
+METRICS = ("total", "sql", "template", "cache")
+
+_current = ContextVar("profiling_timings", default=None)
+_aggregates = defaultdict(lambda: deque(maxlen=WINDOW))
+_lock = threading.Lock()
+
+
+def percentile(values, percent):
+    """Процентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+class Timings:
+    def __init__(self):
+        self.durations = dict.fromkeys(METRICS, 0.0)
+        self.counts = dict.fromkeys(METRICS, 0)
+        self.depth = dict.fromkeys(METRICS, 0)
+
+    def add(self, kind, elapsed):
+        self.durations[kind] += elapsed
+        self.counts[kind] += 1
+
+    def server_timing(self):
+        return ", ".join(
+            '{};dur={:.1f};desc="{} calls"'.format(kind, self.durations[kind] * 1000, self.counts[kind])
+            if kind != "total" else "total;dur={:.1f}".format(self.durations[kind] * 1000)
+            for kind in METRICS
+        )
+
+
+@contextmanager
+def timed(kind):
+    timings = _current.get()
+    if timings is None or timings.depth[kind]:
+        yield
+        return
+    timings.depth[kind] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.depth[kind] -= 1
+        timings.add(kind, time.perf_counter() - started)
+
+
+def _sql(execute, sql, params, many, context):
+    with timed("sql"):
+        return execute(sql, params, many, context)
+
+
+class TimedCache:
+    """Прокси кэша: во время профилируемого запроса замеряет вызовы."""
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def __getattr__(self, name):
+        attr = getattr(self._cache, name)
+        if not callable(attr) or _current.get() is None:
+            return attr
+
+        @wraps(attr)
+        def call(*args, **kwargs):
+            with timed("cache"):
+                return attr(*args, **kwargs)
+        return call
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed("template"):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Бэкенд DjangoTemplates, замеряющий рендер шаблонов."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def record(view_name, timings):
+    with _lock:
+        _aggregates[view_name].append(
+            tuple(timings.durations[kind] for kind in METRICS) + (timings.counts["sql"],)
+        )
+
+
+def stats():
+    """Сводка по view за последние WINDOW запросов этого процесса, в мс."""
+    with _lock:
+        samples = {name: list(values) for name, values in _aggregates.items()}
+    result = {}
+    for name, values in samples.items():
+        totals = [value[0] for value in values]
+        view = {"requests": len(values), "p50": percentile(totals, 50) * 1000, "p95": percentile(totals, 95) * 1000}
+        for index, kind in enumerate(METRICS):
+            view["avg_" + kind] = sum(value[index] for value in values) / len(values) * 1000
+        view["avg_queries"] = sum(value[-1] for value in values) / len(values)
+        result[name] = {key: round(value, 2) for key, value in view.items()}
+    return {"pid": os.getpid(), "window": WINDOW, "views": result}
+
+
+def reset():
+    with _lock:
+        _aggregates.clear()
+
+
+def dump(profiler, view_name):
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    # За секунду один процесс может записать несколько профилей
+    path = os.path.join(settings.PROFILE_DIR, "{}-{}-{}-{}.prof".format(
+        view_name.replace(":", "-"), time.strftime("%Y%m%d-%H%M%S"), os.getpid(), uuid.uuid4().hex[:8]
+    ))
+    profiler.dump_stats(path)
+    return path
+
+
+@contextmanager
+def profiled():
+    """Замеряет всё, что выполняется внутри, отдаёт Timings."""
+    timings = Timings()
+    token = _current.set(timings)
+    started = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(_sql))
+            yield timings
+    finally:
+        timings.durations["total"] = time.perf_counter() - started
+        _current.reset(token)
+
+
+def sampled():
+    return random.random() < settings.PROFILE_SAMPLE_RATE
@@ -0,0 +1,47 @@
+"""Разбор планов запросов: EXPLAIN и поиск полных сканов и сортировок.
+
+Проверяются только таблицы приложения (posts_*): служебные таблицы
+Django мелкие, и их планы нам неинтересны.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+TABLE_PREFIX = "posts_"
+PROBLEMS = {
+    # SQLite: таблица читается целиком или результат досортировывается
+    "sqlite": re.compile(r"^SCAN (TABLE )?{}\w+( AS \w+)?$|USE TEMP B-TREE".format(TABLE_PREFIX)),
+    "postgresql": re.compile(r"Seq Scan on {}\w+|^\s*(->\s*)?(Incremental )?Sort\b".format(TABLE_PREFIX)),
+}
+
+
+def explain(sql, params=(), using=DEFAULT_DB_ALIAS, force_index=True):
+    """Возвращает план запроса списком строк.
+
+    force_index - запретить Postgres полный скан, чтобы увидеть, есть
+    ли подходящий индекс; без него план такой, как в бою.
+    """
+    db = connections[using]
+    with db.cursor() as cursor:
+        if db.vendor == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        if db.vendor == "postgresql" and force_index:
+            # На маленьких таблицах Postgres и с индексом выберет Seq Scan,
+            # а нам важно, есть ли индекс вообще
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                cursor.execute("EXPLAIN " + sql, params)
+                return [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.execute("RESET enable_seqscan")
+        cursor.execute("EXPLAIN " + sql, params)
+        return [" ".join(str(value) for value in row) for row in cursor.fetchall()]
+
+
+def problems(sql, params=()):
+    """Строки плана с полным сканом или сортировкой таблиц posts_*."""
+    pattern = PROBLEMS.get(connection.vendor)
+    if pattern is None or TABLE_PREFIX not in sql:
+        return []
+    return [line for line in explain(sql, params) if pattern.search(line)]
@@ -0,0 +1,170 @@
+"""Полнотекстовый поиск по постам и комментариям.
+
+В PostgreSQL индекс - колонка posts_post.search_vector (tsvector с
+GIN-индексом, её создаёт миграция 0009): текст поста идёт с весом A,
+комментарии - с весом B. На остальных базах слова лежат в таблице
+SearchToken, ранг - сумма весов найденных слов.
+
+Индекс обновляется из сигналов при сохранении и удалении постов и
+комментариев, пересобрать его целиком можно командой rebuild_search.
+В PostgreSQL новый комментарий дописывается к вектору, а правка поста
+меняет только часть с весом A; комментарии поста заново собираются
+лишь при их правке и удалении.
+"""
+import re
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Count, F, Sum
+from django.db.models.expressions import RawSQL
+
+from . import richtext
+from .models import Post, Comment, SearchToken
+
+WORD = re.compile(r"\w+")
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 64
+MAX_QUERY_TERMS = 8
+POST_WEIGHT = 3
+COMMENT_WEIGHT = 1
+BATCH_SIZE = 1000
+
+TS_CONFIG = "russian"
+TS_QUERY = "plainto_tsquery('{}', %s)".format(TS_CONFIG)
+# Комментарии берутся из text_html: это уже очищенный HTML, а теги
+# парсер to_tsvector в лексемы не превращает
+TS_COMMENTS = """
+    setweight(to_tsvector('{config}', coalesce(
+        (SELECT string_agg(text_html, ' ') FROM posts_comment WHERE post_id = %s), ''
+    )), 'B')
+""".format(config=TS_CONFIG)
+TS_POST = "setweight(to_tsvector('{}', %s), 'A')".format(TS_CONFIG)
+TS_COMMENT = "setweight(to_tsvector('{}', %s), 'B')".format(TS_CONFIG)
+# Части вектора по весам: A - текст поста, B - комментарии
+TS_POST_PART = "ts_filter(coalesce(search_vector, ''), '{a}')"
+TS_COMMENTS_PART = "ts_filter(coalesce(search_vector, ''), '{b}')"
+
+
+def uses_tsvector():
+    return connection.vendor == "postgresql"
+
+
+def tokenize(text):
+    words = (word.lower() for word in WORD.findall(text or ""))
+    return [word for word in words if MIN_TOKEN_LENGTH <= len(word) <= MAX_TOKEN_LENGTH]
+
+
+def query_terms(query):
+    terms = []
+    for token in tokenize(query):
+        if token not in terms:
+            terms.append(token)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def _plain(text):
+    return richtext.sanitize(text)[1]
+
+
+def _tokens(text, weight, **fields):
+    return [
+        SearchToken(token=token, weight=count * weight, **fields)
+        for token, count in Counter(tokenize(_plain(text))).items()
+    ]
+
+
+def _update_vector(post_id, document, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE posts_post SET search_vector = {} WHERE id = %s".format(document),
+            list(params) + [post_id],
+        )
+
+
+def index_post(post):
+    if uses_tsvector():
+        # Комментарии остаются в векторе как есть, заново их не собираем
+        _update_vector(post.pk, TS_POST + " || " + TS_COMMENTS_PART, [_plain(post.text)])
+        return
+    SearchToken.objects.filter(post_id=post.pk, comment__isnull=True).delete()
+    SearchToken.objects.bulk_create(_tokens(post.text, POST_WEIGHT, post_id=post.pk))
+
+
+def index_comment(comment, created=False):
+    if uses_tsvector():
+        if created:
+            # Новый комментарий просто дописывается в конец вектора
+            _update_vector(comment.post_id, "coalesce(search_vector, '') || " + TS_COMMENT, [_plain(comment.text)])
+        else:
+            _update_vector(comment.post_id, TS_POST_PART + " || " + TS_COMMENTS, [comment.post_id])
+        return
+    SearchToken.objects.filter(comment_id=comment.pk).delete()
+    SearchToken.objects.bulk_create(
+        _tokens(comment.text, COMMENT_WEIGHT, post_id=comment.post_id, comment_id=comment.pk)
+    )
+
+
+def unindex_comment(comment):
+    # Строки SearchToken удаляются каскадом вместе с комментарием
+    if uses_tsvector():
+        _update_vector(comment.post_id, TS_POST_PART + " || " + TS_COMMENTS, [comment.post_id])
+
+
+def rebuild(chunk_size=BATCH_SIZE):
+    """Пересобирает индекс целиком, возвращает число постов."""
+    count = 0
+    if uses_tsvector():
+        for pk, text in Post.objects.values_list("pk", "text").iterator(chunk_size=chunk_size):
+            _update_vector(pk, TS_POST + " || " + TS_COMMENTS, [_plain(text), pk])
+            count += 1
+        return count
+
+    SearchToken.objects.all().delete()
+    batch = []
+    for pk, text in Post.objects.values_list("pk", "text").iterator(chunk_size=chunk_size):
+        batch += _tokens(text, POST_WEIGHT, post_id=pk)
+        count += 1
+        if len(batch) >= chunk_size:
+            SearchToken.objects.bulk_create(batch)
+            batch = []
+    comments = Comment.objects.values_list("pk", "post_id", "text")
+    for pk, post_id, text in comments.iterator(chunk_size=chunk_size):
+        batch += _tokens(text, COMMENT_WEIGHT, post_id=post_id, comment_id=pk)
+        if len(batch) >= chunk_size:
+            SearchToken.objects.bulk_create(batch)
+            batch = []
+    SearchToken.objects.bulk_create(batch)
+    return count
+
+
+def search(query):
+    """Строки {"post": id, "score": ранг} по убыванию ранга.
+
+    Находятся посты, где встречаются все слова запроса - в тексте
+    или в комментариях. Посты для страницы подставляет attach_posts().
+    """
+    if uses_tsvector():
+        if not query_terms(query):
+            return Post.objects.none().values("id")
+        return Post.objects.extra(
+            where=["search_vector @@ " + TS_QUERY], params=[query]
+        ).annotate(
+            post=F("id"),
+            score=RawSQL("ts_rank(search_vector, {})".format(TS_QUERY), (query,)),
+        ).values("post", "score").order_by("-score", "-id")
+
+    terms = query_terms(query)
+    if not terms:
+        return SearchToken.objects.none().values("post")
+    return SearchToken.objects.filter(token__in=terms).values("post").annotate(
+        score=Sum("weight"),
+        matched=Count("token", distinct=True),
+    ).filter(matched=len(terms)).values("post", "score").order_by("-score", "-post")
+
+
+def attach_posts(page):
+    """Подменяет строки результата на странице постами, сохраняя порядок."""
+    ids = [row["post"] for row in page.object_list]
+    posts = Post.objects.for_listing().in_bulk(ids)
+    page.object_list = [posts[pk] for pk in ids if pk in posts]
+    return page
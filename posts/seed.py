@@ -0,0 +1,171 @@
+"""Синтетические данные для замеров: пользователи, группы, посты,
+комментарии и подписки.
+
+Распределения похожи на живые: немногие авторы пишут большую часть
+постов и собирают большую часть подписчиков (степенной закон), частоты
+слов в текстах - по закону Ципфа. Всё пишется через bulk_create без
+сигналов, производные таблицы пересобираются в конце
+(transfer.rebuild). Пароль у всех пользователей - SEED_PASSWORD.
+"""
+import itertools
+import random
+from datetime import timedelta
+from io import BytesIO
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.sites.models import Site
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Max
+from django.utils import timezone
+
+from . import richtext, transfer
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+PREFIX = "seed"
+SEED_PASSWORD = "yatube-seed"
+DAYS = 365
+IMAGES = 10
+
+SYLLABLES = "ка ро ми ту ле на со ви пе да го лу бре ст".split()
+# Частоты слов в текстах близки к закону Ципфа: немногие слова
+# встречаются почти везде, большинство - редко
+VOCABULARY = ["".join(parts) for parts in itertools.product(SYLLABLES, repeat=3)]
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+
+def power_weights(count, exponent=1.2):
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def text(rnd, words):
+    return " ".join(rnd.choices(VOCABULARY, WEIGHTS, k=words))
+
+
+def _batches(items, size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _images(rnd):
+    """Несколько JPEG в хранилище, посты ссылаются на них по очереди."""
+    names = []
+    for number in range(IMAGES):
+        buffer = BytesIO()
+        color = tuple(rnd.randrange(256) for _ in range(3))
+        Image.new("RGB", (1200, 800), color).save(buffer, "JPEG")
+        name = "posts/{}_{}.jpg".format(PREFIX, number)
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+        names.append(name)
+    return names
+
+
+def _new_ids(model, last):
+    return list(model.objects.filter(id__gt=last or 0).order_by("id").values_list("id", flat=True))
+
+
+def seed(users=1000, groups=20, posts=20000, comments=50000, follows=20, images=0.0, random_seed=None, log=None):
+    """Создаёт данные и возвращает {модель: сколько создано}.
+
+    follows - среднее число подписок на пользователя, images - доля
+    постов с картинкой.
+    """
+    rnd = random.Random(random_seed)
+    log = log or (lambda message: None)
+    now = timezone.now()
+    Site.objects.get_or_create(pk=settings.SITE_ID, defaults={"domain": "localhost:8000", "name": "Yatube"})
+
+    last_user = User.objects.aggregate(last=Max("id"))["last"]
+    start = User.objects.filter(username__startswith=PREFIX).count()
+    password = make_password(SEED_PASSWORD)
+    for batch in _batches(User(username="{}_user{}".format(PREFIX, start + number), password=password)
+                          for number in range(users)):
+        User.objects.bulk_create(batch)
+    user_ids = _new_ids(User, last_user)
+    log("Пользователей: {}".format(len(user_ids)))
+
+    last_group = Group.objects.aggregate(last=Max("id"))["last"]
+    start = Group.objects.filter(slug__startswith=PREFIX).count()
+    Group.objects.bulk_create(
+        Group(title="Группа {}".format(start + number), slug="{}-group-{}".format(PREFIX, start + number),
+              description=text(rnd, 20), rules=text(rnd, 10))
+        for number in range(groups)
+    )
+    group_ids = _new_ids(Group, last_group)
+
+    # Порядок в user_ids задаёт популярность: первые пишут больше всех
+    author_weights = power_weights(len(user_ids))
+    image_names = _images(rnd) if images and posts else []
+    last_post = transfer.next_id(Post) - 1
+    # Id задаются сразу: по ним create_with_dates возвращает даты
+    new_post_ids = itertools.count(last_post + 1)
+
+    def make_posts():
+        for _ in range(posts):
+            post = Post(
+                id=next(new_post_ids),
+                text="<p>{}</p>".format(text(rnd, rnd.randint(10, 200))),
+                author_id=rnd.choices(user_ids, author_weights)[0],
+                group_id=rnd.choice(group_ids) if group_ids and rnd.random() < 0.7 else None,
+                pub_date=now - timedelta(seconds=rnd.randrange(DAYS * 24 * 60 * 60)),
+                image=rnd.choice(image_names) if image_names and rnd.random() < images else "",
+            )
+            post.modified = post.pub_date
+            richtext.render_post(post)
+            yield post
+
+    for batch in _batches(make_posts()):
+        transfer.create_with_dates(Post, batch)
+    post_dates = dict(Post.objects.filter(id__gt=last_post).values_list("id", "pub_date"))
+    post_ids = sorted(post_dates)
+    log("Постов: {}".format(len(post_ids)))
+    new_comment_ids = itertools.count(transfer.next_id(Comment))
+
+    def make_comments():
+        # Обсуждают в основном свежие и популярные посты
+        weights = power_weights(len(post_ids), 0.8)
+        for post_id in rnd.choices(post_ids[::-1], weights, k=comments) if post_ids else ():
+            # Комментарий пишут после поста, но не позже текущего момента
+            pub_date = post_dates[post_id]
+            created = pub_date + timedelta(seconds=rnd.randrange(max(int((now - pub_date).total_seconds()), 1)))
+            comment = Comment(id=next(new_comment_ids), post_id=post_id, author_id=rnd.choice(user_ids),
+                              text=text(rnd, rnd.randint(3, 40)), created=created)
+            richtext.render_comment(comment)
+            yield comment
+
+    for batch in _batches(make_comments()):
+        transfer.create_with_dates(Comment, batch)
+    log("Комментариев: {}".format(comments if post_ids else 0))
+
+    def make_follows():
+        # И число подписок у читателя, и популярность автора - степенной закон
+        for user_id in user_ids:
+            count = min(int(rnd.paretovariate(1.5) * follows / 3), len(user_ids) - 1)
+            authors = set(rnd.choices(user_ids, author_weights, k=count)) - {user_id}
+            for author_id in authors:
+                yield Follow(user_id=user_id, author_id=author_id)
+
+    last_follow = Follow.objects.aggregate(last=Max("id"))["last"]
+    for batch in _batches(make_follows()):
+        Follow.objects.bulk_create(batch, ignore_conflicts=True)
+    # ignore_conflicts молча пропускает уже существующие подписки
+    follow_count = Follow.objects.filter(id__gt=last_follow or 0).count()
+    log("Подписок: {}".format(follow_count))
+
+    log("Пересборка счётчиков, лент и поиска...")
+    transfer.rebuild()
+    return {"user": len(user_ids), "group": len(group_ids), "post": len(post_ids),
+            "comment": comments if post_ids else 0, "follow": follow_count}
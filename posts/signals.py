@@ -0,0 +1,152 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import authors, counters, generations, richtext, search, surrogate, thumbnails, timeline
+from .models import Post, Group, Comment, Follow
+
+User = get_user_model()
+
+
+def changed(*scopes):
+    """Сбрасывает кэши приложения и ставит области в очередь очистки прокси."""
+    generations.bump(*scopes)
+    surrogate.enqueue(*scopes)
+
+
+def post_scopes(post_id, author_id, *group_slugs):
+    scopes = [generations.INDEX, generations.post(post_id), generations.author(author_id)]
+    scopes += [generations.group(slug) for slug in group_slugs if slug]
+    return scopes
+
+
+def bump_for_post_id(post_id):
+    row = Post.objects.filter(pk=post_id).values_list("author_id", "group__slug").first()
+    if row is not None:
+        changed(*post_scopes(post_id, *row))
+
+
+def bump_for_follow(follow):
+    # Счётчики подписок и кнопка подписки видны на страницах обоих
+    changed(
+        generations.follow(follow.user_id),
+        generations.author(follow.author_id),
+        generations.author(follow.user_id),
+    )
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, **kwargs):
+    richtext.render_post(instance)
+    # Пост могли перенести в другую группу или заменить картинку
+    instance._previous_group_slug = None
+    previous_image = None
+    if instance.pk:
+        previous = Post.objects.filter(pk=instance.pk).values_list("group__slug", "image").first()
+        if previous is not None:
+            instance._previous_group_slug, previous_image = previous
+    instance._image_changed = (previous_image or "") != (instance.image.name or "")
+    if instance._image_changed:
+        thumbnails.reset(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out(instance)
+        counters.bump_user(instance.author_id, "post_count", 1)
+        authors.forget_ids(instance.author_id)
+    if getattr(instance, "_image_changed", False) and instance.image:
+        thumbnails.enqueue(instance)
+    search.index_post(instance)
+    group_slug = instance.group.slug if instance.group_id else None
+    changed(*post_scopes(
+        instance.pk, instance.author_id, group_slug, getattr(instance, "_previous_group_slug", None)
+    ))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, "post_count", -1)
+    authors.forget_ids(instance.author_id)
+    group_slug = Group.objects.filter(pk=instance.group_id).values_list("slug", flat=True).first()
+    changed(*post_scopes(instance.pk, instance.author_id, group_slug))
+
+
+@receiver(pre_save, sender=Comment)
+def comment_saving(sender, instance, **kwargs):
+    richtext.render_comment(instance)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_comments(instance.post_id, 1)
+    search.index_comment(instance, created)
+    bump_for_post_id(instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.bump_comments(instance.post_id, -1)
+    search.unindex_comment(instance)
+    bump_for_post_id(instance.post_id)
+
+
+@receiver(pre_save, sender=Group)
+def group_saving(sender, instance, **kwargs):
+    # Страницы группы лежат по slug: при переименовании сбросим и старые
+    instance._previous_slug = None
+    if instance.pk:
+        instance._previous_slug = Group.objects.filter(pk=instance.pk).values_list("slug", flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # Название группы есть в карточках постов: обновим их отметку
+    Post.objects.filter(group_id=instance.pk).update(modified=timezone.now())
+    slugs = {instance.slug, getattr(instance, "_previous_slug", None)} - {None}
+    changed(generations.INDEX, generations.GROUPS, *map(generations.group, slugs))
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill(instance.user_id, instance.author_id)
+        counters.bump_user(instance.author_id, "following_count", 1)
+        counters.bump_user(instance.user_id, "follower_count", 1)
+        authors.forget_ids(instance.author_id, instance.user_id)
+        bump_for_follow(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    timeline.trim(instance.user_id, instance.author_id)
+    counters.bump_user(instance.author_id, "following_count", -1)
+    counters.bump_user(instance.user_id, "follower_count", -1)
+    authors.forget_ids(instance.author_id, instance.user_id)
+    bump_for_follow(instance)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    # Карточка лежит по username: при переименовании сбросим и старую
+    instance._previous_username = None
+    if instance.pk and (update_fields is None or "username" in update_fields):
+        instance._previous_username = User.objects.filter(pk=instance.pk).values_list(
+            "username", flat=True
+        ).first()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_username", None)
+    authors.forget(instance.username, *([previous] if previous else []))
+    if previous and previous != instance.username:
+        # Имя автора есть в карточках его постов: обновим их отметку
+        Post.objects.filter(author_id=instance.pk).update(modified=timezone.now())
+        slugs = Group.objects.filter(group__author_id=instance.pk).values_list("slug", flat=True).distinct()
+        changed(generations.INDEX, generations.author(instance.pk), *map(generations.group, slugs))
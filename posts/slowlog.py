@@ -0,0 +1,82 @@
+"""Журнал медленных SQL-запросов в JSON.
+
+На каждое новое соединение ставится execute_wrapper. Запрос дольше
+SLOW_QUERY_MS пишется в лог posts.slowlog с длительностью,
+нормализованным SQL (sqlaudit.normalize), алиасом базы и именем view,
+а при SLOW_QUERY_EXPLAIN ещё и с планом SELECT. Быстрые запросы
+попадают в лог с вероятностью SLOW_QUERY_SAMPLE_RATE. Запрос, который
+в лог не попал, не форматируется и не нормализуется.
+"""
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import queryplan, sqlaudit
+
+logger = logging.getLogger(__name__)
+
+current_view = ContextVar("slowlog_view", default=None)
+# EXPLAIN идёт через то же соединение и не должен логироваться сам
+_explaining = ContextVar("slowlog_explaining", default=False)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data.update(getattr(record, "query", {}))
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _plan(sql, params, alias):
+    if not sql.lstrip()[:6].upper() == "SELECT":
+        return None
+    token = _explaining.set(True)
+    try:
+        return queryplan.explain(sql, params, using=alias, force_index=False)
+    except Exception as error:  # план - подсказка, запрос уже выполнен
+        return ["EXPLAIN failed: {}".format(error)]
+    finally:
+        _explaining.reset(token)
+
+
+def log_query(execute, sql, params, many, context):
+    if _explaining.get():
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        slow = elapsed * 1000 >= settings.SLOW_QUERY_MS
+        if slow or random.random() < settings.SLOW_QUERY_SAMPLE_RATE:
+            alias = context["connection"].alias
+            entry = {
+                "duration_ms": round(elapsed * 1000, 3),
+                "sql": sqlaudit.normalize(sql),
+                "view": current_view.get(),
+                "db": alias,
+                "many": many,
+            }
+            if slow and settings.SLOW_QUERY_EXPLAIN and not many:
+                entry["plan"] = _plan(sql, params, alias)
+            logger.log(logging.WARNING if slow else logging.INFO,
+                       "slow query" if slow else "sampled query", extra={"query": entry})
+
+
+@receiver(connection_created)
+def install(sender, connection, **kwargs):
+    # В начало списка: соединение может открыться внутри
+    # connection.execute_wrapper(), который при выходе снимает последний
+    if settings.SLOW_QUERY_LOG and log_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, log_query)
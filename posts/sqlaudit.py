@@ -0,0 +1,105 @@
+"""Учёт SQL-запросов страницы: бюджеты по именам URL и поиск N+1.
+
+Запросы группируются по форме: литералы и параметры заменяются на ?,
+списки IN (?, ?, ...) сворачиваются. Если одна форма повторяется
+больше REPEAT_LIMIT раз, скорее всего запрос выполняется в цикле
+по объектам.
+
+Бюджеты считаются для холодного кэша: при попадании в кэш
+запросов меньше.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPEAT_LIMIT = 2
+# Сессия и пользователь для авторизованных запросов входят в бюджет
+BUDGETS = {
+    "index": 2,
+    "group": 3,
+    "search": 3,
+    "profile": 3,
+    "post": 6,
+    "follow_index": 5,
+    "new_post": 3,
+    "post_edit": 4,
+    "add_comment": 9,
+    "post_comments": 1,
+    "profile_follow": 11,
+    "profile_unfollow": 9,
+    "rss": 2,
+    "atom": 2,
+    "group_rss": 3,
+    "group_atom": 3,
+    "profile_rss": 3,
+    "profile_atom": 3,
+    "api_posts": 1,
+    "api_post": 2,
+    "api_post_comments": 2,
+    "api_group_posts": 1,
+    "api_user_posts": 2,
+    "api_follow_posts": 4,
+}
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+PLACEHOLDER = re.compile(r"%s|\?")
+IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SPACES = re.compile(r"\s+")
+
+
+def normalize(sql):
+    sql = STRING.sub("?", sql)
+    sql = NUMBER.sub("?", sql)
+    sql = PLACEHOLDER.sub("?", sql)
+    sql = IN_LIST.sub("(...)", sql)
+    return SPACES.sub(" ", sql).strip()
+
+
+class QueryAudit:
+    """execute_wrapper, запоминающий форму и длительность запросов."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((normalize(sql), time.perf_counter() - started))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(elapsed for _, elapsed in self.queries)
+
+    def shapes(self):
+        return Counter(shape for shape, _ in self.queries)
+
+    def repeated(self, limit=REPEAT_LIMIT):
+        """Формы запросов, выполненные больше limit раз."""
+        return {shape: count for shape, count in self.shapes().items() if count > limit}
+
+    def problems(self, url_name):
+        """Список нарушений: превышение бюджета и повторы запросов."""
+        found = []
+        budget = BUDGETS.get(url_name)
+        if budget is not None and self.count > budget:
+            found.append("{}: {} queries, budget {}".format(url_name, self.count, budget))
+        for shape, count in self.repeated().items():
+            found.append("{}: {}x {}".format(url_name, count, shape))
+        return found
+
+
+@contextmanager
+def audit(using=DEFAULT_DB_ALIAS):
+    report = QueryAudit()
+    with connections[using].execute_wrapper(report):
+        yield report
@@ -0,0 +1,83 @@
+"""Заголовки для кэширующего прокси и очередь его очистки.
+
+Суррогатные ключи страницы - её области из posts/generations.py:
+index, groups, group-<slug>, author-<id>, post-<id>. Анонимные
+ответы помечаются public с s-maxage, остальные - private. Сигналы
+ставят изменившиеся области в очередь PurgeRequest, воркер purge_cdn
+отправляет их пачками на CDN_PURGE_URL. Ключи, которые не удалось
+отправить за MAX_ATTEMPTS попыток, удаляются из очереди с записью
+в журнал: прокси сам забудет их через PROXY_CACHE_TIMEOUT.
+"""
+import json
+import logging
+import urllib.request
+
+from django.conf import settings
+from django.db.models import F
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from . import pagecache
+from .models import PurgeRequest
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 10
+# Ленты подписок у каждого свои, прокси их не кэширует
+PRIVATE_PREFIXES = ("follow-",)
+
+
+def add_headers(request, response, scopes):
+    patch_vary_headers(response, ("Cookie",))
+    if response.status_code == 304:
+        # 304 повторяет заголовки кэширования, которые были бы у 200
+        public = pagecache.is_cacheable_request(request) and not request.user.is_authenticated
+    else:
+        public = pagecache.is_public(request, response)
+    if not public:
+        patch_cache_control(response, private=True)
+        return response
+    patch_cache_control(response, public=True, max_age=0, s_maxage=settings.PROXY_CACHE_TIMEOUT)
+    response["Surrogate-Key"] = " ".join(scopes)
+    return response
+
+
+def enqueue(*scopes):
+    if not settings.CDN_PURGE_URL:
+        return
+    PurgeRequest.objects.bulk_create(
+        PurgeRequest(key=scope) for scope in set(scopes) if not scope.startswith(PRIVATE_PREFIXES)
+    )
+
+
+def send(keys):
+    body = json.dumps({"surrogate_keys": keys}).encode()
+    request = urllib.request.Request(settings.CDN_PURGE_URL, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+    })
+    if settings.CDN_PURGE_TOKEN:
+        request.add_header("Authorization", "Bearer {}".format(settings.CDN_PURGE_TOKEN))
+    with urllib.request.urlopen(request, timeout=settings.CDN_PURGE_TIMEOUT) as response:
+        response.read()
+
+
+def process(batch_size=100):
+    """Отправляет одну пачку очереди, возвращает (ключей отправлено, строк с ошибкой)."""
+    rows = list(PurgeRequest.objects.filter(
+        attempts__lt=MAX_ATTEMPTS
+    ).order_by("id").values_list("id", "key")[:batch_size])
+    if not rows:
+        return 0, 0
+    ids = [pk for pk, _ in rows]
+    keys = sorted({key for _, key in rows})
+    try:
+        send(keys)
+    except OSError as error:  # URLError, HTTPError и таймауты
+        PurgeRequest.objects.filter(pk__in=ids).update(attempts=F("attempts") + 1, last_error=str(error))
+        exhausted = PurgeRequest.objects.filter(pk__in=ids, attempts__gte=MAX_ATTEMPTS)
+        dropped = sorted(set(exhausted.values_list("key", flat=True)))
+        if dropped:
+            logger.error("purge: ключи %s не очищены за %s попыток: %s", " ".join(dropped), MAX_ATTEMPTS, error)
+            exhausted.delete()
+        return 0, len(ids)
+    PurgeRequest.objects.filter(pk__in=ids).delete()
+    return len(keys), 0
@@ -0,0 +1,49 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts import thumbnails
+
+register = template.Library()
+
+CARD_TIMEOUT = 60 * 60 * 24
+# Место для ссылки "Редактировать": она зависит от зрителя и в кэш не попадает
+EDIT_SLOT = "<!-- edit-link -->"
+
+
+def card_key(post):
+    return "post_card:{}:{}".format(post.pk, post.modified.timestamp())
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Собирает ленту из закэшированных карточек post_item.html.
+
+    Все карточки страницы читаются одним get_many, недостающие
+    рендерятся (миниатюры для них ищутся одним батчем) и записываются
+    одним set_many.
+    """
+    posts = list(posts)
+    keys = [card_key(post) for post in posts]
+    cards = cache.get_many(keys)
+
+    missing = [(key, post) for key, post in zip(keys, posts) if key not in cards]
+    thumbnails.prefetch([post for _, post in missing])
+    rendered = {
+        key: render_to_string("post_item.html", {"post": post})
+        for key, post in missing
+    }
+    if rendered:
+        cache.set_many(rendered, CARD_TIMEOUT)
+        cards.update(rendered)
+
+    user = context.get("user")
+    viewer_id = user.pk if user is not None and user.is_authenticated else None
+    html = []
+    for key, post in zip(keys, posts):
+        edit_link = ""
+        if viewer_id is not None and viewer_id == post.author_id:
+            edit_link = render_to_string("post_edit_link.html", {"post": post})
+        html.append(cards[key].replace(EDIT_SLOT, edit_link))
+    return mark_safe("".join(html))
@@ -1,11 +1,56 @@
+import json
+import os
+import pstats
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.sites.models import Site
 from django.core import mail
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import F, Max, Sum
 from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
 
+from yatube.cache import LOCK_KEY, TwoTierCache
 from yatube.settings import TEST_CACHE
+from . import authors, benchmark, generations, outbox, pagecache, profiling, queryplan, richtext, search, seed, slowlog, sqlaudit, surrogate, thumbnails, timeline, transfer
 from .forms import PostForm
-from .models import User, Post, Group, Follow
+from .pagination import encode_cursor
+from .templatetags.post_cards import card_key
+from .models import User, Post, Group, Comment, Follow, OutboxMessage, PurgeRequest, SearchToken, ThumbnailJob, TimelineEntry, UserCounters
+
+
+# Тесты работают с тем же TwoTierCache, что и сайт, но его L2 живёт в
+# памяти процесса: файловый кэш из настроек тесты не читают и не чистят
+LOCAL_CACHES = {
+    'default': settings.CACHES['default'],
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'yatube-tests',
+    },
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class LocalCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
 
 
 @override_settings(CACHES=TEST_CACHE)
@@ -29,6 +74,8 @@ class ProfileTest(TestCase):
                              'password1': 'skynetMy',
                              'password2': 'skynetMy',
                          }, follow=True)
+        self.assertEqual(len(mail.outbox), 0, msg='Письмо должно уходить через очередь')
+        call_command('run_outbox', once=True, stdout=StringIO())
         self.assertEqual(len(mail.outbox), 1, msg='Письмо не отправлено')
         self.assertEqual(mail.outbox[0].subject, 'Подтверждение регистрации Yatube', msg='Тема письма неверная')
 
@@ -169,30 +216,1208 @@ class ProfileTest(TestCase):
         self.assertNotContains(response2, text='Комментарий!', msg_prefix='Комментария быть не должно')
 
 
-class ServerErrorsTest(TestCase):
+class ServerErrorsTest(LocalCacheTestCase):
     def test_404_page_not_found(self):
         response = self.client.get('/page_never_be_real/')
         self.assertEqual(response.status_code, 404, msg='Проверь существование страницы')
 
 
-class Cache(TestCase):
+class Cache(LocalCacheTestCase):
     def setUp(self):
-        User.objects.create_user(username='test_user', email='example@ex.com', password='skynetMy')
+        super().setUp()
+        self.user = User.objects.create_user(username='test_user', email='example@ex.com', password='skynetMy')
         self.client.post('/auth/login/', data={'username': 'test_user', 'password': 'skynetMy'}, follow=False)
 
     def test_cache(self):
-        key = make_template_fragment_key('index_page', [1])
+        generation = generations.current(generations.INDEX)
+        key = make_template_fragment_key('index_page', [generation, 1, self.user.id])
         self.assertFalse(cache.get(key))
         self.client.get("/")
         self.assertTrue(cache.get(key))
 
     def test_cache_index(self):
+        self.client.get('/')
         response = self.client.post('/new/', data={'text': 'Проверка кэша'}, follow=True)
-        response1 = self.client.get('/')
 
         self.assertRedirects(response, '/', status_code=302, target_status_code=200)
-        self.assertNotContains(response1, text='Проверка кэша', msg_prefix='Поста не должно быть на странице')
+        self.assertContains(response, text='Проверка кэша', count=1,
+                            msg_prefix='Новый пост должен сбрасывать кэш главной страницы')
 
-        cache.clear()
-        self.assertContains(response=self.client.get('/'), text='Проверка кэша', count=1,
-                            msg_prefix='После очистки кэша не видно пост')
+    def test_cache_invalidated_by_comment_and_group(self):
+        group = Group.objects.create(title='Cats', slug='cats', description='Описание', rules='Правила')
+        post = Post.objects.create(text='Пост в группе', author=self.user, group=group)
+        self.assertContains(self.client.get('/group/cats/'), text='#Cats')
+        self.assertContains(self.client.get('/test_user/'), text='Добавить комментарий')
+
+        group.title = 'Dogs'
+        group.save()
+        Comment.objects.create(text='Первый', author=self.user, post=post)
+        self.assertContains(self.client.get('/group/cats/'), text='#Dogs')
+        self.assertContains(self.client.get('/test_user/'), text='1 комментариев')
+
+
+@override_settings(CACHES=TEST_CACHE, FEED_PAGINATION='cursor')
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test_user', email='example@ex.com', password='skynetMy')
+        self.posts = [Post.objects.create(text='Пост номер {}'.format(i), author=self.user) for i in range(12)]
+
+    def test_cursor_pages_cover_feed_without_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertFalse([q for q in queries if 'COUNT(*)' in q['sql'] and 'posts_post' in q['sql']],
+                         msg='Курсорная пагинация не должна считать записи')
+        first_page = response.context['page']
+        self.assertEqual(len(first_page), 10)
+        self.assertFalse(first_page.has_previous())
+        self.assertTrue(first_page.has_next())
+
+        response = self.client.get('/', {'after': first_page.next_cursor})
+        second_page = response.context['page']
+        self.assertEqual([post.id for post in second_page], [self.posts[1].id, self.posts[0].id])
+        self.assertFalse(second_page.has_next())
+        self.assertContains(response, text='?before={}'.format(second_page.previous_cursor))
+
+        response = self.client.get('/', {'before': second_page.previous_cursor})
+        self.assertEqual([post.id for post in response.context['page']], [post.id for post in first_page])
+
+    def test_broken_cursor_returns_first_page(self):
+        response = self.client.get('/', {'after': 'не-курсор'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page'][0], self.posts[-1])
+
+
+class TimelineTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reader = User.objects.create_user(username='reader', password='skynetMy')
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.old_post = Post.objects.create(text='Старый пост', author=self.author)
+
+    def test_follow_backfills_and_new_post_fans_out(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(text='Новый пост', author=self.author)
+        self.assertEqual(list(timeline.feed(self.reader).values_list('post_id', flat=True)),
+                         [new_post.id, self.old_post.id])
+
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+
+    def test_rebuild_timelines_command(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader, post=self.old_post).count(), 1)
+
+
+class CountersTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reader = User.objects.create_user(username='reader', password='skynetMy')
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+
+    def test_counters_follow_writes(self):
+        comment = Comment.objects.create(text='Комментарий', author=self.reader, post=self.post)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual((self.author.counters.post_count, self.author.counters.following_count), (1, 1))
+        self.assertEqual(self.reader.counters.follower_count, 1)
+
+        comment.delete()
+        Follow.objects.filter(user=self.reader).delete()
+        self.post.refresh_from_db()
+        self.author.counters.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.author.counters.following_count), (0, 0))
+
+    def test_reconcile_counters_repairs_drift(self):
+        self.client.get('/author/')
+        self.assertIsNotNone(cache.get(authors.CARD_KEY.format('author')))
+        Post.objects.filter(pk=self.post.pk).update(comment_count=7)
+        modified = Post.objects.get(pk=self.post.pk).modified
+        UserCounters.objects.filter(user=self.author).update(post_count=0)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+        self.assertGreater(self.post.modified, modified, msg='Карточка поста должна перерисоваться')
+        self.assertEqual(UserCounters.objects.get(user=self.author).post_count, 1)
+        self.assertIsNone(cache.get(authors.CARD_KEY.format('author')))
+
+    def test_profile_reads_counters(self):
+        UserCounters.objects.filter(user=self.author).update(post_count=42)
+        response = self.client.get('/author/')
+        self.assertContains(response, text='Записей: 42')
+
+
+TWO_TIER_CACHE = {
+    'default': {
+        'BACKEND': 'yatube.cache.TwoTierCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {'L1_MAX_ENTRIES': 2, 'SHARED_ONLY_PREFIXES': ['generation:']},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'two-tier-tests',
+    },
+}
+
+
+@override_settings(CACHES=TWO_TIER_CACHE)
+class TwoTierCacheTest(TestCase):
+    def setUp(self):
+        self.cache = TwoTierCache('shared', TWO_TIER_CACHE['default'])
+        self.cache.clear()
+
+    def test_l1_lru_eviction_and_stats(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.set('c', 3)
+        self.assertEqual(self.cache.get('b'), 2)
+        stats = self.cache.stats()
+        self.assertEqual(stats['l1']['evictions'], 2)
+        self.assertEqual(stats['l1']['hits'], 1)
+        self.assertEqual(stats['l2']['hits'], 1)
+
+    def test_expired_key_is_rebuilt_once(self):
+        self.cache.set('page', 'старое', timeout=10)
+        with mock.patch('time.time', return_value=time.time() + 15):
+            self.assertIsNone(self.cache.get('page'), msg='Первый запрос должен пересчитать значение')
+            self.assertEqual(self.cache.get('page'), 'старое', msg='Остальные получают старое значение')
+            self.cache.set('page', 'новое', timeout=10)
+            self.assertEqual(self.cache.get('page'), 'новое')
+        self.assertEqual(self.cache.stats()['l2']['rebuilds'], 1)
+
+    def test_cold_miss_is_rebuilt_once(self):
+        other_process = TwoTierCache('shared', TWO_TIER_CACHE['default'])
+        self.assertIsNone(self.cache.get('page'), msg='Первый промах пересчитывает значение')
+        rebuild = threading.Timer(0.1, self.cache.set, ('page', 'новое'))
+        rebuild.start()
+        self.addCleanup(rebuild.join)
+        self.assertEqual(other_process.get('page'), 'новое', msg='Второй ждёт значение первого')
+        self.assertEqual(other_process.stats()['l2'], {'waits': 1})
+
+    def test_delete_releases_waiters(self):
+        other_process = TwoTierCache('shared', TWO_TIER_CACHE['default'])
+        self.assertIsNone(self.cache.get('page'))
+        giving_up = threading.Timer(0.05, self.cache.delete, ('page',))
+        giving_up.start()
+        self.addCleanup(giving_up.join)
+        started = time.monotonic()
+        self.assertIsNone(other_process.get('page'))
+        self.assertLess(time.monotonic() - started, 0.3)
+
+    def test_shared_only_keys_support_incr(self):
+        self.cache.add('generation:index', 1, timeout=None)
+        self.cache.incr('generation:index')
+        self.assertEqual(caches['shared'].get('generation:index'), 2)
+
+    def test_locked_incr_keeps_counter_without_expiry(self):
+        shared_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, shared_dir, ignore_errors=True)
+        file_caches = {**TWO_TIER_CACHE, 'shared': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': shared_dir,
+        }}
+        with override_settings(CACHES=file_caches):
+            two_tier = TwoTierCache('shared', file_caches['default'])
+            with self.assertRaises(ValueError):
+                two_tier.incr('generation:index')
+            two_tier.add('generation:index', 1, timeout=None)
+            self.assertEqual([two_tier.incr('generation:index') for _ in range(3)], [2, 3, 4])
+            self.assertIsNone(caches['shared'].get(LOCK_KEY.format('generation:index')))
+            with mock.patch('time.time', return_value=time.time() + 10 ** 6):
+                self.assertEqual(caches['shared'].get('generation:index'), 4)
+
+
+class PostCardsTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.reader = User.objects.create_user(username='reader', password='skynetMy')
+        self.post = Post.objects.create(text='Карточка поста', author=self.author)
+
+    def test_card_is_cached_and_edit_link_is_per_viewer(self):
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get('/'), text='Редактировать', count=1)
+        self.assertIsNotNone(cache.get(card_key(self.post)))
+
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.client.get('/'), text='Редактировать')
+
+    def test_comment_refreshes_card(self):
+        self.client.get('/')
+        Comment.objects.create(text='Комментарий', author=self.reader, post=self.post)
+        self.post.refresh_from_db()
+        self.assertIsNone(cache.get(card_key(self.post)))
+        self.assertContains(self.client.get('/'), text='1 комментариев')
+
+
+class RichTextTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='author', password='skynetMy')
+
+    def test_sanitize_keeps_toolbar_markup_only(self):
+        html, text = richtext.sanitize(
+            '<p style="text-align: center; position: fixed">Привет <b>мир</b><script>alert(1)</script></p>'
+            '<a href="javascript:alert(1)" onclick="x()">ссылка</a><img src="x.png"><ul><li>пункт'
+        )
+        self.assertEqual(html, '<p style="text-align: center">Привет <b>мир</b></p><a>ссылка</a><ul><li>пункт</li></ul>')
+        self.assertEqual(text, 'Привет мир ссылка пункт')
+
+    def test_post_and_comment_are_rendered_on_save(self):
+        post = Post.objects.create(text='<p>Раз два <i>три</i></p><iframe src="//evil"></iframe>', author=self.user)
+        self.assertEqual(post.text_html, '<p>Раз два <i>три</i></p>')
+        self.assertEqual((post.excerpt, post.word_count), ('Раз два три', 3))
+
+        comment = Comment.objects.create(text='строка\nещё', author=self.user, post=post)
+        self.assertEqual(comment.text_html, '<p>строка<br>ещё</p>')
+
+    def test_markup_dropped_by_sanitizer_is_not_rendered(self):
+        post = Post.objects.create(text='<img src=x onerror=alert(1)>', author=self.user)
+        Comment.objects.create(text='<img src=x onerror=alert(2)>', author=self.user, post=post)
+        self.assertEqual(post.text_html, '')
+        response = self.client.get('/author/{}/'.format(post.pk))
+        self.assertNotContains(response, 'onerror')
+
+    def test_render_richtext_command_backfills(self):
+        post = Post.objects.create(text='<b>Текст</b>', author=self.user)
+        Post.objects.filter(pk=post.pk).update(text_html='', excerpt='')
+        call_command('render_richtext', chunk_size=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual((post.text_html, post.excerpt), ('<b>Текст</b>', 'Текст'))
+
+
+@override_settings(CACHES=TEST_CACHE)
+class ListingProjectionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='skynetMy')
+        self.group = Group.objects.create(title='Cats', slug='cats', description='Описание' * 100, rules='Правила')
+        for i in range(3):
+            Post.objects.create(text='<p>Длинный текст {}</p>'.format(i) * 50, author=self.user, group=self.group)
+
+    def test_feeds_do_not_load_full_bodies(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/group/cats/')
+        self.assertContains(response, text='Читать далее', count=3)
+        post_queries = [query['sql'] for query in queries if 'FROM "posts_post"' in query['sql']]
+        self.assertTrue(post_queries)
+        for sql in post_queries:
+            self.assertNotIn('"posts_post"."text"', sql)
+            self.assertNotIn('"posts_group"."description"', sql)
+
+    def test_cards_without_excerpt_do_not_load_text(self):
+        Post.objects.update(excerpt='')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/group/cats/')
+        self.assertFalse(any('"posts_post"."text"' in query['sql'] for query in queries))
+
+    def test_bench_listing_command(self):
+        out = StringIO()
+        call_command('bench_listing', pages=1, repeat=1, stdout=out)
+        self.assertIn('for_listing()', out.getvalue())
+
+
+def make_image(name='image.png', size=(1200, 600)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color=(200, 30, 30)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(CACHES=TEST_CACHE)
+class ThumbnailPipelineTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='author', password='skynetMy')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_upload_queues_job_and_worker_fills_srcset(self):
+        self.client.post('/new/', data={'text': 'С картинкой', 'image': make_image()})
+        post = Post.objects.get(text='С картинкой')
+        self.assertTrue(ThumbnailJob.objects.filter(post=post).exists())
+        self.assertContains(self.client.get('/'), text='src="{}"'.format(post.image.url))
+
+        call_command('generate_thumbnails', once=True, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertFalse(ThumbnailJob.objects.exists())
+        self.assertEqual(post.thumbnail_srcset.count('w,'), len(thumbnails.SRCSET_WIDTHS) - 1)
+        self.assertContains(self.client.get('/'), text='srcset="{}"'.format(post.thumbnail_srcset))
+
+        self.client.post('/author/{}/edit/'.format(post.id),
+                         data={'text': 'С картинкой', 'image': make_image('other.png')})
+        post.refresh_from_db()
+        self.assertEqual(post.thumbnail_url, '')
+        self.assertTrue(ThumbnailJob.objects.filter(post=post).exists())
+
+    def test_failed_job_backs_off(self):
+        post = Post.objects.create(text='Битая картинка', author=self.user, image=make_image())
+        thumbnails.enqueue(post)
+        with mock.patch.object(thumbnails, 'generate', side_effect=OSError('broken image')) as generate:
+            self.assertEqual(thumbnails.process(), (0, 1))
+            self.assertEqual(thumbnails.process(), (0, 0))
+            self.assertEqual(generate.call_count, 1)
+
+            job = ThumbnailJob.objects.get(post=post)
+            self.assertEqual((job.attempts, job.last_error), (1, 'broken image'))
+            self.assertGreater(job.next_attempt_at, timezone.now())
+
+            ThumbnailJob.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(thumbnails.process(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+
+    def test_page_resolves_thumbnails_in_one_batch(self):
+        posts = [Post.objects.create(text='Пост {}'.format(i), author=self.user, image=make_image()) for i in range(3)]
+        existing = get_thumbnail(posts[0].image, thumbnails.GEOMETRY, **thumbnails.OPTIONS)
+
+        self.user.is_staff = True
+        self.user.save()
+        thumbnails._count(100, 100)  # остаток от прошлого запроса этого потока
+        with override_settings(PROFILING=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertEqual(thumbnails.get_stats(), {'lookups': 2, 'thumbnails': 3})
+        self.assertIn('thumbnails;desc="3 thumbnails in 2 lookups"', response['Server-Timing'])
+        self.assertEqual(len([q for q in queries if 'thumbnail_kvstore' in q['sql']]), 1)
+        self.assertContains(response, text='src="{}"'.format(existing.url), count=1)
+        self.assertContains(response, text='width="960" height="339"', count=1)
+
+
+@override_settings(CACHES=TEST_CACHE)
+class SearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='skynetMy')
+        self.post = Post.objects.create(text='<p>Кот спит на <b>окне</b></p>', author=self.user)
+        self.other = Post.objects.create(text='Собака гуляет', author=self.user)
+
+    def found(self, query):
+        return [row['post'] for row in search.search(query)]
+
+    def test_index_follows_posts_and_comments(self):
+        self.assertEqual(self.found('кот окне'), [self.post.pk])
+        self.assertEqual(self.found('кот собака'), [])
+
+        comment = Comment.objects.create(text='Кот тоже гуляет', author=self.user, post=self.other)
+        # Слово в тексте поста весит больше, чем в комментарии
+        self.assertEqual(self.found('кот'), [self.post.pk, self.other.pk])
+        comment.delete()
+        self.assertEqual(self.found('кот'), [self.post.pk])
+
+        self.post.text = 'Пёс спит'
+        self.post.save()
+        self.assertEqual(self.found('кот'), [])
+        self.assertEqual(self.found('b'), [])
+
+    def test_tsvector_updates_do_not_regather_comments(self):
+        with mock.patch.object(search, 'uses_tsvector', return_value=True), \
+                mock.patch.object(search, '_update_vector') as update:
+            self.post.save()
+            comment = Comment.objects.create(text='<script>кот</script>Пёс', author=self.user, post=self.post)
+            comment.save()
+            comment.delete()
+        (_, edited, _), (_, created, plain), (_, changed, _), (_, deleted, _) = [call[0] for call in update.call_args_list]
+        self.assertEqual(plain, ['Пёс'])
+        self.assertNotIn('posts_comment', created)
+        self.assertNotIn('posts_comment', edited)
+        self.assertIn('string_agg(text_html', changed)
+        self.assertEqual(changed, deleted)
+
+    def test_search_view_keeps_query_in_pages(self):
+        for i in range(11):
+            Post.objects.create(text='Кот номер {}'.format(i), author=self.user)
+        response = self.client.get('/search/', {'q': 'кот'})
+        self.assertEqual(response.context['paginator'].count, 12)
+        self.assertEqual(len(response.context['page']), 10)
+        self.assertContains(response, '?page=2&amp;q=%D0%BA%D0%BE%D1%82')
+
+    def test_rebuild_search_command(self):
+        SearchToken.objects.all().delete()
+        call_command('rebuild_search', stdout=StringIO())
+        self.assertEqual(self.found('собака'), [self.other.pk])
+
+
+@override_settings(CACHES=TEST_CACHE)
+class QueryPlanTest(TestCase):
+    """Запросы страниц не должны читать таблицы целиком и досортировывать."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username='user{}'.format(i), password='skynetMy') for i in range(5)]
+        cls.group = Group.objects.create(title='Cats', slug='cats', description='Описание', rules='Правила')
+        for i in range(60):
+            post = Post.objects.create(text='Пост {}'.format(i), author=cls.users[i % 5],
+                                       group=cls.group if i % 2 else None)
+            comment = Comment.objects.create(text='Комментарий', author=cls.users[0], post=post)
+        cls.comment_cursor = encode_cursor(comment.created, comment.pk)
+        for author in cls.users[1:]:
+            Follow.objects.create(user=cls.users[0], author=author)
+        cls.post = post
+
+    def assertPlansUseIndexes(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            with self.subTest(url=url, sql=query['sql']):
+                self.assertEqual(queryplan.problems(query['sql']), [])
+
+    def test_anonymous_pages(self):
+        for url in ('/', '/?page=3', '/group/cats/', '/user1/', '/user1/?page=2',
+                    '/{}/{}/'.format(self.post.author.username, self.post.pk),
+                    '/{}/{}/comments/?after={}'.format(self.post.author.username, self.post.pk, self.comment_cursor)):
+            self.assertPlansUseIndexes(url)
+
+    def test_follow_page(self):
+        self.client.force_login(self.users[0])
+        self.assertPlansUseIndexes('/follow/')
+        self.assertPlansUseIndexes('/follow/?page=2')
+
+    @override_settings(FEED_PAGINATION='cursor')
+    def test_cursor_pages(self):
+        response = self.client.get('/')
+        self.assertPlansUseIndexes('/?after=' + response.context['page'].next_cursor)
+        self.assertPlansUseIndexes('/?before=' + response.context['page'].next_cursor)
+
+
+@override_settings(CACHES=TEST_CACHE)
+class QueryBudgetTest(TestCase):
+    """Каждое имя URL из posts/urls.py укладывается в бюджет запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username='user{}'.format(i), password='skynetMy') for i in range(6)]
+        cls.group = Group.objects.create(title='Cats', slug='cats', description='Описание', rules='Правила')
+        for i in range(30):
+            post = Post.objects.create(text='Кот {}'.format(i), author=cls.users[i % 3],
+                                       group=cls.group if i % 2 else None)
+            for author in cls.users:
+                Comment.objects.create(text='Комментарий', author=author, post=post)
+        for user in cls.users:
+            for author in cls.users[:3]:
+                if user != author:
+                    Follow.objects.create(user=user, author=author)
+        cls.post = post
+        Site.objects.update_or_create(pk=settings.SITE_ID, defaults={'domain': 'testserver', 'name': 'Yatube'})
+
+    def setUp(self):
+        self.author = self.post.author
+        self.reader = self.users[5]
+
+    def requests(self):
+        return benchmark.routes(self.post, self.reader, 'cats', self.users[4])
+
+    def test_every_url_name_has_budget(self):
+        from .api_urls import urlpatterns as api_urlpatterns
+        from .urls import urlpatterns
+        self.assertEqual({pattern.name for pattern in urlpatterns + api_urlpatterns}, set(sqlaudit.BUDGETS))
+        self.assertEqual({name for name, *_ in self.requests()}, set(sqlaudit.BUDGETS))
+
+    def test_views_fit_budgets(self):
+        for name, user, method, url, data in self.requests():
+            with self.subTest(url=url, user=user):
+                self.client.logout()
+                if user is not None:
+                    self.client.force_login(user)
+                with sqlaudit.audit() as report:
+                    response = getattr(self.client, method)(url, data)
+                self.assertIn(response.status_code, (200, 302))
+                self.assertEqual(response.resolver_match.url_name, name)
+                self.assertEqual(report.problems(name), [])
+
+    def test_normalize_and_repeats(self):
+        self.assertEqual(
+            sqlaudit.normalize("SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2,3) AND c = %s"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ?',
+        )
+        with sqlaudit.audit() as report:
+            for comment in Comment.objects.filter(post=self.post):
+                comment.author.username
+        self.assertEqual(list(report.repeated().values()), [6])
+        self.assertTrue(report.problems('post'))
+
+    @override_settings(QUERY_AUDIT=True)
+    def test_middleware_logs_budget_overrun(self):
+        with mock.patch.dict(sqlaudit.BUDGETS, {'index': 1}), self.assertLogs('posts.sqlaudit', 'WARNING') as logs:
+            response = self.client.get('/')
+        self.assertEqual(response['X-Query-Count'], '2')
+        self.assertIn('index: 2 queries, budget 1', logs.output[0])
+
+
+@override_settings(CACHES=TEST_CACHE)
+class CommentsPaginationTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.post = Post.objects.create(text='Вирусный пост', author=self.author)
+        for i in range(45):
+            Comment.objects.create(text='Комментарий {}'.format(i), author=self.author, post=self.post)
+        self.url = '/author/{}/'.format(self.post.pk)
+
+    def test_first_page_inline_and_next_pages_as_fragments(self):
+        response = self.client.get(self.url)
+        first = response.context['comments']
+        self.assertEqual(len(first), 20)
+        self.assertEqual(first[0].text, 'Комментарий 0')
+        self.assertContains(response, 'data-fragment="{}comments/?after={}"'.format(self.url, first.next_cursor))
+
+        fragment = self.client.get(self.url + 'comments/', {'after': first.next_cursor})
+        self.assertTemplateUsed(fragment, 'comments_page.html')
+        self.assertTemplateNotUsed(fragment, 'post.html')
+        second = fragment.context['comments']
+        self.assertEqual([c.text for c in second][:2], ['Комментарий 20', 'Комментарий 21'])
+        last = self.client.get(self.url + 'comments/', {'after': second.next_cursor}).context['comments']
+        self.assertEqual((len(last), last.has_next()), (5, False))
+
+    def test_add_comment_redirects_to_its_page(self):
+        reader = User.objects.create_user(username='reader', password='skynetMy')
+        self.client.force_login(reader)
+        response = self.client.post(self.url + 'comment/', {'text': 'Новый'})
+        comment = Comment.objects.get(text='Новый')
+        self.assertTrue(response.url.startswith(self.url + '?after='))
+        self.assertTrue(response.url.endswith('#comment_{}'.format(comment.pk)))
+
+        page = self.client.get(response.url).context['comments']
+        self.assertEqual(page[0], comment)
+        self.assertTrue(page.has_previous())
+
+
+class AuthorCardTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='author', password='skynetMy', first_name='Лев')
+        self.reader = User.objects.create_user(username='reader', password='skynetMy')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+
+    def test_card_is_cached_without_secrets(self):
+        self.client.get('/author/')
+        card = cache.get(authors.CARD_KEY.format('author'))
+        self.assertEqual((card.get_full_name(), card.counters.post_count), ('Лев', 1))
+        self.assertNotIn('password', card.__dict__)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/author/{}/'.format(self.post.pk))
+        self.assertEqual(response.context['profile'], self.author)
+        self.assertFalse(any('FROM "auth_user"' in query['sql'] for query in queries.captured_queries))
+
+    def test_posts_and_follows_reset_card(self):
+        self.client.get('/author/')
+        self.client.force_login(self.reader)
+        self.client.get('/author/follow/')
+        response = self.client.get('/author/')
+        self.assertEqual(response.context['counters'].following_count, 1)
+        self.assertTrue(response.context['following'])
+
+        Post.objects.create(text='Ещё пост', author=self.author)
+        self.client.logout()
+        response = self.client.get('/author/')
+        self.assertEqual(response.context['counters'].post_count, 2)
+        self.assertFalse(response.context['following'])
+
+    def test_rename_resets_old_card_and_post_cards(self):
+        self.post.group = Group.objects.create(title='Cats', slug='cats', description='Описание', rules='Правила')
+        self.post.save()
+        self.client.get('/author/')
+        self.assertContains(self.client.get('/group/cats/'), text='@author')
+
+        self.author.username = 'writer'
+        self.author.save()
+        self.assertIsNone(cache.get(authors.CARD_KEY.format('author')))
+        self.assertEqual(self.client.get('/author/').status_code, 404)
+        for url in ('/', '/group/cats/', '/writer/'):
+            response = self.client.get(url)
+            self.assertContains(response, text='@writer', msg_prefix=url)
+            self.assertNotContains(response, text='@author', msg_prefix=url)
+
+
+class ConditionalGetTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.reader = User.objects.create_user(username='reader', password='skynetMy')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+
+    def test_etag_answers_304_without_queries(self):
+        for url in ('/', '/author/', '/author/{}/'.format(self.post.pk)):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertIn('Cookie', response['Vary'])
+
+    def test_changes_and_viewer_change_etag(self):
+        etag = self.client.get('/')['ETag']
+        self.assertNotEqual(self.client.get('/?page=2')['ETag'], etag)
+
+        Comment.objects.create(text='Комментарий', author=self.reader, post=self.post)
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get('/author/')['ETag']
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get('/author/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get('/author/')['ETag']
+        self.client.get('/author/follow/')
+        self.assertEqual(self.client.get('/author/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_new_login_does_not_reuse_stale_comment_form(self):
+        client = Client(enforce_csrf_checks=True)
+        url = '/author/{}/'.format(self.post.pk)
+
+        def login():
+            client.get('/auth/login/')
+            client.post('/auth/login/', {
+                'username': 'reader', 'password': 'skynetMy',
+                'csrfmiddlewaretoken': client.cookies[settings.CSRF_COOKIE_NAME].value,
+            })
+
+        login()
+        etag = client.get(url)['ETag']
+        client.get('/auth/logout/')
+        login()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200, msg='После входа форма с прежним CSRF-токеном устарела')
+
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        response = client.post(url + 'comment/', {'text': 'После входа', 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Comment.objects.filter(text='После входа').exists())
+
+    def test_last_modified_only_for_anonymous(self):
+        last_modified = self.client.get('/')['Last-Modified']
+        self.assertEqual(self.client.get('/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        self.client.force_login(self.reader)
+        self.assertFalse(self.client.get('/').has_header('Last-Modified'))
+
+
+class PageCacheTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        pagecache.reset()
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.other = User.objects.create_user(username='other', password='skynetMy')
+        self.group = Group.objects.create(title='Cats', slug='cats', description='Описание', rules='Правила')
+        self.post = Post.objects.create(text='Пост', author=self.author, group=self.group)
+        Post.objects.create(text='Другой пост', author=self.other)
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        first = self.client.get('/group/cats/')
+        self.assertFalse(first.has_header('X-Page-Cache'))
+        with self.assertNumQueries(0):
+            second = self.client.get('/group/cats/')
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.client.get('/group/cats/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    def test_changes_purge_only_their_scopes(self):
+        for url in ('/', '/group/cats/', '/author/', '/other/'):
+            self.client.get(url)
+        Comment.objects.create(text='Комментарий', author=self.other, post=self.post)
+        hits = {url: self.client.get(url).has_header('X-Page-Cache') for url in ('/', '/group/cats/', '/author/', '/other/')}
+        self.assertEqual(hits, {'/': False, '/group/cats/': False, '/author/': False, '/other/': True})
+
+        Follow.objects.create(user=self.other, author=self.author)
+        self.assertFalse(self.client.get('/other/').has_header('X-Page-Cache'))
+
+    def test_uncacheable_misses_do_not_stall_next_request(self):
+        for url in ('/nobody/1/', '/group/nope/', '/nobody/1/', '/group/nope/'):
+            started = time.monotonic()
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.assertLess(time.monotonic() - started, 0.3, msg=url)
+
+    def test_logged_in_users_bypass_cache(self):
+        self.client.get('/')
+        self.client.force_login(self.other)
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        self.assertContains(response, 'Пользователь: other')
+
+    def test_stats(self):
+        self.client.get('/')
+        size = len(self.client.get('/').content)
+        stats = pagecache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['stores']), (1, 1, 1))
+        self.assertEqual((stats['bytes_served'], stats['hit_ratio']), (size, 0.5))
+
+        staff = User.objects.create_user(username='staff', password='skynetMy', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/panel/stats/').json()['page_cache']['hits'], 1)
+
+
+
+class PurgeStub(BaseHTTPRequestHandler):
+    """Заглушка API очистки CDN: запоминает тела запросов."""
+    received = []
+    status = 200
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        PurgeStub.received.append((self.headers.get('Authorization'), json.loads(body.decode())))
+        self.send_response(PurgeStub.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class SurrogateKeysTest(LocalCacheTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), PurgeStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.purge_url = 'http://127.0.0.1:{}/purge'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        PurgeStub.received, PurgeStub.status = [], 200
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+
+    def test_anonymous_pages_are_public_with_keys(self):
+        response = self.client.get('/author/{}/'.format(self.post.pk))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('s-maxage=600', response['Cache-Control'])
+        self.assertEqual(response['Surrogate-Key'], 'author-{} post-{}'.format(self.author.pk, self.post.pk))
+        self.assertEqual(self.client.get('/')['Surrogate-Key'], 'index')
+
+        self.client.force_login(self.author)
+        response = self.client.get('/')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertFalse(response.has_header('Surrogate-Key'))
+
+    def test_changes_are_purged_in_batches(self):
+        with override_settings(CDN_PURGE_URL=self.purge_url, CDN_PURGE_TOKEN='secret'):
+            Comment.objects.create(text='Раз', author=self.author, post=self.post)
+            Comment.objects.create(text='Два', author=self.author, post=self.post)
+            self.assertEqual(PurgeRequest.objects.count(), 6)
+
+            PurgeStub.status = 503
+            call_command('purge_cdn', once=True, stdout=StringIO(), stderr=StringIO())
+            self.assertEqual(set(PurgeRequest.objects.values_list('attempts', flat=True)), {1})
+
+            PurgeStub.status = 200
+            call_command('purge_cdn', once=True, stdout=StringIO())
+        self.assertFalse(PurgeRequest.objects.exists())
+        self.assertEqual(PurgeStub.received[-1], ('Bearer secret', {
+            'surrogate_keys': sorted(['index', 'author-{}'.format(self.author.pk), 'post-{}'.format(self.post.pk)]),
+        }))
+
+    def test_exhausted_keys_are_dropped_and_logged(self):
+        with override_settings(CDN_PURGE_URL=self.purge_url):
+            surrogate.enqueue('index')
+            PurgeRequest.objects.update(attempts=surrogate.MAX_ATTEMPTS - 1)
+            PurgeStub.status = 503
+            with self.assertLogs('posts.surrogate', 'ERROR') as logs:
+                self.assertEqual(surrogate.process(), (0, 1))
+        self.assertIn('index', logs.output[0])
+        self.assertFalse(PurgeRequest.objects.exists())
+
+    def test_group_rename_purges_old_and_new_slug(self):
+        group = Group.objects.create(title='Коты', slug='cats', description='Описание', rules='Правила')
+        with override_settings(CDN_PURGE_URL=self.purge_url):
+            group.slug = 'kittens'
+            group.save()
+        self.assertEqual(set(PurgeRequest.objects.values_list('key', flat=True)),
+                         {'index', 'groups', 'group-cats', 'group-kittens'})
+
+    def test_queue_is_off_without_purge_url(self):
+        Comment.objects.create(text='Раз', author=self.author, post=self.post)
+        self.assertFalse(PurgeRequest.objects.exists())
+
+
+class ApiTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.reader = User.objects.create_user(username='reader', password='skynetMy')
+        self.group = Group.objects.create(title='Cats', slug='cats', description='Описание', rules='Правила')
+        self.posts = [Post.objects.create(text='Пост {}'.format(i), author=self.author, group=self.group)
+                      for i in range(3)]
+
+    def test_fields_and_cursor(self):
+        response = self.client.get('/api/v1/posts/', {'limit': 2, 'fields': 'id,author'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['results'], [{'id': post.pk, 'author': 'author'} for post in self.posts[:0:-1]])
+        self.assertIsNone(data['previous'])
+
+        data = self.client.get('/api/v1/posts/', {'limit': 2, 'fields': 'id', 'after': data['next']}).json()
+        self.assertEqual(data['results'], [{'id': self.posts[0].pk}])
+        self.assertIsNone(data['next'])
+
+        response = self.client.get('/api/v1/posts/', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['detail'])
+
+    def test_group_user_post_and_comments(self):
+        post = self.posts[0]
+        Comment.objects.create(text='Комментарий', author=self.reader, post=post)
+        self.assertEqual(len(self.client.get('/api/v1/groups/cats/posts/').json()['results']), 3)
+        self.assertEqual(len(self.client.get('/api/v1/users/author/posts/').json()['results']), 3)
+        self.assertEqual(self.client.get('/api/v1/users/nobody/posts/').status_code, 404)
+
+        data = self.client.get('/api/v1/posts/{}/'.format(post.pk)).json()
+        self.assertEqual((data['id'], data['group'], data['comment_count']), (post.pk, 'cats', 1))
+        self.assertEqual(self.client.get('/api/v1/posts/0/').status_code, 404)
+
+        data = self.client.get('/api/v1/posts/{}/comments/'.format(post.pk)).json()
+        self.assertEqual([comment['author'] for comment in data['results']], ['reader'])
+
+    def test_unknown_group_and_post_are_404(self):
+        for url in ('/api/v1/groups/nobody/posts/', '/api/v1/posts/0/comments/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 404)
+                self.assertIn('detail', response.json())
+        Group.objects.create(title='Пустая', slug='empty', description='Описание', rules='Правила')
+        empty = {'results': [], 'next': None, 'previous': None}
+        self.assertEqual(self.client.get('/api/v1/groups/empty/posts/').json(), empty)
+        self.assertEqual(self.client.get('/api/v1/posts/{}/comments/'.format(self.posts[1].pk)).json(), empty)
+
+    def test_conditional_requests(self):
+        url = '/api/v1/posts/{}/'.format(self.posts[0].pk)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Comment.objects.create(text='Комментарий', author=self.reader, post=self.posts[0])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Имя автора есть в посте и в комментариях к нему
+        for url in (url, url + 'comments/'):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                self.author.username = 'renamed-{}'.format(len(url))
+                self.author.save()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_follow_feed(self):
+        response = self.client.get('/api/v1/follow/posts/')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get('/api/v1/follow/posts/').json()['results'], [])
+        Follow.objects.create(user=self.reader, author=self.author)
+        data = self.client.get('/api/v1/follow/posts/', {'fields': 'id'}).json()
+        self.assertEqual(data['results'], [{'id': post.pk} for post in reversed(self.posts)])
+
+
+class FeedTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        Site.objects.update_or_create(pk=settings.SITE_ID, defaults={'domain': 'testserver', 'name': 'Yatube'})
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.group = Group.objects.create(title='Cats', slug='cats', description='Про котов', rules='Правила')
+        self.post = Post.objects.create(text='Кот в ленте', author=self.author, group=self.group)
+        self.other = Post.objects.create(text='Без группы', author=self.author)
+
+    def test_feeds_list_scope_posts(self):
+        response = self.client.get('/group/cats/rss/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('application/rss+xml', response['Content-Type'])
+        self.assertContains(response, 'Кот в ленте')
+        self.assertNotContains(response, 'Без группы')
+
+        response = self.client.get('/author/atom/')
+        self.assertIn('application/atom+xml', response['Content-Type'])
+        self.assertContains(response, '/author/{}/'.format(self.other.pk))
+        self.assertContains(response, '/author/{}/'.format(self.post.pk))
+
+        self.assertContains(self.client.get('/rss/'), 'Без группы')
+        self.assertEqual(self.client.get('/group/dogs/rss/').status_code, 404)
+        self.assertEqual(self.client.get('/nobody/atom/').status_code, 404)
+
+    def test_feed_size_is_bounded(self):
+        with mock.patch('posts.feeds.FEED_SIZE', 1):
+            response = self.client.get('/rss/')
+        self.assertEqual(response.content.decode().count('<item>'), 1)
+
+    def test_polling_gets_not_modified_until_next_post(self):
+        response = self.client.get('/group/cats/atom/')
+        last_modified = response['Last-Modified']
+        with self.assertNumQueries(0):
+            response = self.client.get('/group/cats/atom/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        Post.objects.create(text='Без группы снова', author=self.author)
+        response = self.client.get('/group/cats/atom/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        # Last-Modified с точностью до секунды: следующий пост - через минуту
+        later = mock.Mock(time=mock.Mock(return_value=time.time() + 60))
+        with mock.patch('posts.generations.time', later):
+            Post.objects.create(text='Второй кот', author=self.author, group=self.group)
+        response = self.client.get('/group/cats/atom/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Второй кот')
+
+
+class OutboxTest(LocalCacheTestCase):
+    def test_message_is_written_with_its_transaction(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            User.objects.create_user(username='ghost', password='skynetMy')
+            outbox.enqueue('signup_mail', email='ghost@ex.com')
+            raise RuntimeError
+        self.assertFalse(OutboxMessage.objects.exists())
+        with self.assertRaises(ValueError):
+            outbox.enqueue('unknown')
+
+    def test_batch_reuses_one_connection(self):
+        for i in range(3):
+            outbox.enqueue('signup_mail', email='user{}@ex.com'.format(i))
+        with mock.patch('posts.outbox.mail.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(outbox.process(), (3, 0))
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['user0@ex.com', 'user1@ex.com', 'user2@ex.com'])
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_failures_back_off_and_go_dead(self):
+        flaky = mock.Mock(side_effect=OSError('SMTP недоступен'))
+        with mock.patch.dict(outbox.HANDLERS, {'flaky': flaky}):
+            message = outbox.enqueue('flaky', n=1)
+            self.assertEqual(outbox.process(), (0, 1))
+            flaky.assert_called_once_with({'n': 1}, mock.ANY)
+            message.refresh_from_db()
+            self.assertEqual((message.attempts, message.dead, message.last_error), (1, False, 'SMTP недоступен'))
+            # До конца паузы сообщение не берётся
+            self.assertEqual(outbox.process(), (0, 0))
+
+            OutboxMessage.objects.filter(pk=message.pk).update(attempts=outbox.MAX_ATTEMPTS - 1,
+                                                               available_at=message.created)
+            self.assertEqual(outbox.process(), (0, 1))
+            message.refresh_from_db()
+            self.assertTrue(message.dead)
+
+            flaky.side_effect = None
+            self.assertEqual(outbox.requeue_dead(), 1)
+            self.assertEqual(outbox.process(), (1, 0))
+        self.assertFalse(OutboxMessage.objects.exists())
+
+
+class TransferTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='author', first_name='Лев', password='skynetMy')
+        self.reader = User.objects.create_user(username='reader', password='skynetMy')
+        self.group = Group.objects.create(title='Cats', slug='cats', description='Описание', rules='Правила')
+        self.post = Post.objects.create(text='<p>Кот</p><script>x</script>', author=self.author, group=self.group)
+        Post.objects.create(text='Без группы', author=self.reader)
+        Comment.objects.create(text='Мяу', author=self.reader, post=self.post)
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def export(self):
+        stream = StringIO()
+        counts = transfer.export(stream, chunk_size=1)
+        self.assertEqual(counts, {'group': 1, 'user': 2, 'post': 2, 'comment': 1, 'follow': 1})
+        return stream.getvalue()
+
+    def test_round_trip_into_empty_tables(self):
+        data = self.export()
+        pub_date = self.post.pub_date
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+        out = StringIO()
+        with mock.patch('sys.stdin', StringIO(data)):
+            call_command('import_content', batch_size=1, stdout=out)
+        self.assertIn('строк/с', out.getvalue())
+
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.author.username, post.author.first_name, post.group.slug), ('author', 'Лев', 'cats'))
+        self.assertEqual(post.pub_date, pub_date)
+        self.assertNotIn('script', post.text_html)
+        self.assertEqual(post.comment_count, 1)
+        self.assertFalse(post.author.has_usable_password())
+        reader = User.objects.get(username='reader')
+        self.assertTrue(Follow.objects.filter(user=reader, author=post.author).exists())
+        self.assertEqual(list(timeline.feed(reader).values_list('post_id', flat=True)), [post.pk])
+        self.assertEqual(UserCounters.objects.get(user=post.author).following_count, 1)
+
+    def test_import_next_to_existing_rows(self):
+        data = self.export()
+        Group.objects.create(title='Dogs', slug='dogs', description='Описание', rules='Правила')
+        transfer.load(StringIO(data), batch_size=2)
+        self.assertEqual(Post.objects.filter(text='Без группы').count(), 2)
+        self.assertEqual(Comment.objects.filter(text='Мяу').count(), 2)
+        self.assertEqual(Group.objects.count(), 2)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(Post.objects.create(text='Новый', author=self.author).pk, Post.objects.aggregate(
+            last=Max('id'))['last'])
+
+    def test_dates_are_kept_without_touching_model_fields(self):
+        created = self.post.pub_date - timedelta(days=3)
+        comment_id = transfer.next_id(Comment)
+        transfer.create_with_dates(Comment, [
+            Comment(id=comment_id, post=self.post, author=self.reader, text='Старый', created=created),
+        ])
+        self.assertEqual(Comment.objects.get(pk=comment_id).created, created)
+        self.assertTrue(Comment._meta.get_field('created').auto_now_add)
+        self.assertGreater(Comment.objects.create(text='Новый', author=self.reader, post=self.post).pk, comment_id)
+
+    def test_broken_line_is_reported(self):
+        with self.assertRaisesMessage(CommandError, 'Строки 1-1'):
+            with mock.patch('sys.stdin', StringIO('{"model": "post", "author": "nobody"}\n')):
+                call_command('import_content', stdout=StringIO())
+        with self.assertRaisesMessage(ValueError, 'Строка 2: неизвестная модель'):
+            transfer.load(StringIO('\n{"model": "session"}\n'))
+        with self.assertRaisesMessage(CommandError, 'Не удалось открыть'):
+            call_command('import_content', '/nonexistent/content.jsonl', stdout=StringIO())
+
+    def test_failed_import_leaves_nothing_behind(self):
+        data = self.export().replace('"model": "follow", "user": "reader"', '"model": "follow", "user": "nobody"')
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        with self.assertRaisesMessage(ValueError, 'nobody'):
+            transfer.load(StringIO(data))
+        self.assertEqual((User.objects.count(), Post.objects.count(), Comment.objects.count()), (0, 0, 0))
+
+
+class SeedBenchmarkTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_seed_and_benchmark(self):
+        counts = seed.seed(users=20, groups=3, posts=60, comments=100, follows=4, images=0.2, random_seed=1)
+        self.assertEqual((counts['user'], counts['group'], counts['post'], counts['comment']), (20, 3, 60, 100))
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertTrue(Post.objects.exclude(image='').exists())
+        self.assertTrue(Follow.objects.exists())
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        self.assertEqual(counts['follow'], Follow.objects.count())
+        self.assertFalse(Comment.objects.filter(created__lt=F('post__pub_date')).exists())
+        # Производные таблицы пересобраны
+        self.assertEqual(UserCounters.objects.aggregate(total=Sum('post_count'))['total'], 60)
+        self.assertTrue(TimelineEntry.objects.exists())
+        # Даты постов разбросаны по году, а не равны времени вставки
+        self.assertNotEqual(Post.objects.earliest('pub_date').pub_date.date(), Post.objects.latest('pub_date').pub_date.date())
+
+        output = '{}/bench.json'.format(self.media_root)
+        cache.set('kept', 'value')
+        call_command('bench_views', repeat=3, cold=True, output=output, stdout=StringIO())
+        # Замеры работают со своим кэшем и общий не очищают
+        self.assertEqual(cache.get('kept'), 'value')
+        call_command('bench_views', repeat=3, output=output, stdout=StringIO())
+        call_command('bench_views', repeat=1, routes=['index'], output=output, compare=output, stdout=StringIO())
+        with open(output, encoding='utf-8') as stream:
+            results = json.load(stream)['results']
+        self.assertEqual([result['name'] for result in results], ['index'])
+        self.assertEqual(results[0]['status'], 200)
+        self.assertLessEqual(results[0]['p50_ms'], results[0]['p99_ms'])
+        self.assertGreater(results[0]['peak_kb'], 0)
+        # Замеры откатывают пишущие запросы
+        self.assertFalse(Comment.objects.filter(text='Ещё').exists())
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((benchmark.percentile(values, 50), benchmark.percentile(values, 99)), (50, 99))
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+
+
+@override_settings(PROFILING=True)
+class ProfilingTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        profiling.reset()
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        self.staff = User.objects.create_user(username='staff', password='skynetMy', is_staff=True)
+        Post.objects.create(text='Пост', author=self.author)
+
+    def test_server_timing_and_aggregates(self):
+        self.assertFalse(self.client.get('/').has_header('Server-Timing'))
+        self.client.force_login(self.staff)
+        response = self.client.get('/')
+        timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'total', 'sql', 'template', 'cache', 'thumbnails'})
+        self.assertEqual(timing['thumbnails'], 'desc="0 thumbnails in 0 lookups"')
+        self.assertNotIn('desc="0 calls"', timing['sql'])
+        self.assertNotIn('desc="0 calls"', timing['template'])
+        self.assertNotIn('desc="0 calls"', timing['cache'])
+
+        self.client.get('/author/')
+        self.client.get('/author/')
+        views = profiling.stats()['views']
+        # Замеры собираются по всем запросам, а не только по запросам персонала
+        self.assertEqual((views['index']['requests'], views['profile']['requests']), (2, 2))
+        self.assertLessEqual(views['profile']['p50'], views['profile']['p95'])
+
+        self.assertIn('profile', self.client.get('/panel/stats/').json()['profile']['views'])
+
+    def test_nested_measurements_count_once(self):
+        with profiling.profiled() as timings:
+            with profiling.timed('template'):
+                with profiling.timed('template'):
+                    pass
+        self.assertEqual(timings.counts['template'], 1)
+        with profiling.timed('template'):
+            pass  # вне запроса замеры не собираются
+
+    def test_sampled_requests_are_profiled_to_disk(self):
+        profile_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=profile_dir):
+                self.client.get('/author/')
+                self.client.get('/author/')
+            files = os.listdir(profile_dir)
+            # Два профиля за одну секунду не затирают друг друга
+            self.assertEqual(len(files), 2)
+            self.assertTrue(files[0].startswith('profile-'))
+            pstats.Stats(os.path.join(profile_dir, files[0]))
+        finally:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+class SlowQueryLogTest(LocalCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='author', password='skynetMy')
+        Post.objects.create(text='Пост', author=self.author)
+
+    def test_slow_queries_are_logged_as_json(self):
+        self.assertIn(slowlog.log_query, connection.execute_wrappers)
+        with override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_EXPLAIN=True), \
+                self.assertLogs('posts.slowlog', 'WARNING') as logs:
+            self.client.get('/author/')
+        records = [record for record in logs.records if record.query['view'] == 'profile']
+        self.assertTrue(records)
+        query = next(record.query for record in records if 'posts_post' in record.query['sql'])
+        self.assertNotIn("'author'", query['sql'])
+        self.assertTrue(query['plan'])
+        self.assertGreaterEqual(query['duration_ms'], 0)
+
+        data = json.loads(slowlog.JsonFormatter().format(records[0]))
+        self.assertEqual((data['level'], data['message'], data['view']), ('WARNING', 'slow query', 'profile'))
+
+    def test_fast_queries_are_sampled_without_formatting(self):
+        with override_settings(SLOW_QUERY_MS=10 ** 6, SLOW_QUERY_SAMPLE_RATE=0), \
+                mock.patch('posts.slowlog.sqlaudit.normalize') as normalize, \
+                mock.patch.object(slowlog.logger, 'log') as log:
+            self.client.get('/author/')
+        normalize.assert_not_called()
+        log.assert_not_called()
+
+        with override_settings(SLOW_QUERY_MS=10 ** 6, SLOW_QUERY_SAMPLE_RATE=1), \
+                self.assertLogs('posts.slowlog', 'INFO') as logs:
+            Post.objects.count()
+        self.assertEqual([record.getMessage() for record in logs.records], ['sampled query'])
+        self.assertIsNone(logs.records[0].query['view'])
+        self.assertNotIn('plan', logs.records[0].query)
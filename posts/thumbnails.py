@@ -0,0 +1,162 @@
+import logging
+import threading
+
+from django.db.models import F
+from django.utils import timezone
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import settings as sorl_settings, defaults as sorl_defaults
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from .models import Post, ThumbnailJob
+from .outbox import backoff
+
+logger = logging.getLogger(__name__)
+
+# Как в шаблонах: {% thumbnail post.image "960x339" crop="center" upscale=True %}
+GEOMETRY = "960x339"
+OPTIONS = {"crop": "center", "upscale": True}
+SRCSET_WIDTHS = (480, 768, 960)
+MAX_ATTEMPTS = 5
+
+_stats = threading.local()
+
+
+def enqueue(post):
+    ThumbnailJob.objects.update_or_create(
+        post=post, defaults={
+            "created": timezone.now(), "attempts": 0, "next_attempt_at": timezone.now(), "last_error": "",
+        }
+    )
+
+
+def reset(post):
+    post.thumbnail_url = post.thumbnail_srcset = ""
+
+
+def _thumbnail(image, geometry):
+    thumbnail = get_thumbnail(image, geometry, **OPTIONS)
+    # sorl при ошибке чтения исходника молча возвращает несуществующий файл
+    if not thumbnail.exists():
+        raise IOError("Не удалось создать миниатюру {} для {}".format(geometry, image.name))
+    return thumbnail
+
+
+def generate(post):
+    """Создаёт миниатюры и возвращает (url основной, srcset)."""
+    width, height = (int(side) for side in GEOMETRY.split("x"))
+    main = _thumbnail(post.image, GEOMETRY)
+    srcset = []
+    for srcset_width in SRCSET_WIDTHS:
+        geometry = "{}x{}".format(srcset_width, round(srcset_width * height / width))
+        thumbnail = main if geometry == GEOMETRY else _thumbnail(post.image, geometry)
+        srcset.append("{} {}w".format(thumbnail.url, srcset_width))
+    return main.url, ", ".join(srcset)
+
+
+def process(batch_size=20):
+    """Обрабатывает порцию заданий, возвращает (готово, с ошибкой)."""
+    jobs = ThumbnailJob.objects.select_related("post").filter(
+        attempts__lt=MAX_ATTEMPTS, next_attempt_at__lte=timezone.now()
+    ).order_by("created")[:batch_size]
+    done = failed = 0
+    for job in jobs:
+        post = job.post
+        if not post.image:
+            job.delete()
+            continue
+        try:
+            url, srcset = generate(post)
+        except Exception as error:  # ошибки Pillow и хранилища бывают любыми
+            # Битая картинка не должна выбрать все попытки подряд
+            ThumbnailJob.objects.filter(pk=job.pk).update(
+                attempts=F("attempts") + 1, last_error=str(error),
+                next_attempt_at=timezone.now() + backoff(job.attempts + 1),
+            )
+            failed += 1
+            continue
+        # Картинку могли заменить, пока мы работали: тогда ждём нового задания
+        Post.objects.filter(pk=post.pk, image=post.image.name).update(
+            thumbnail_url=url, thumbnail_srcset=srcset, modified=timezone.now()
+        )
+        ThumbnailJob.objects.filter(pk=job.pk, created=job.created).delete()
+        done += 1
+    return done, failed
+
+
+def reset_stats():
+    _stats.lookups = _stats.thumbnails = 0
+
+
+def get_stats():
+    """Сколько обращений к KV-хранилищу sorl и миниатюр было с reset_stats().
+
+    ProfilingMiddleware сбрасывает счётчики в начале каждого запроса
+    и отдаёт их в Server-Timing.
+    """
+    return {
+        "lookups": getattr(_stats, "lookups", 0),
+        "thumbnails": getattr(_stats, "thumbnails", 0),
+    }
+
+
+def _count(lookups, thumbnails):
+    _stats.lookups = getattr(_stats, "lookups", 0) + lookups
+    _stats.thumbnails = getattr(_stats, "thumbnails", 0) + thumbnails
+
+
+def _thumbnail_file(image):
+    """ImageFile миниатюры GEOMETRY, как её назовёт sorl.get_thumbnail()."""
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(OPTIONS)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault("format", backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return ImageFile(backend._get_thumbnail_filename(source, GEOMETRY, options), default.storage)
+
+
+def prefetch(posts):
+    """Находит готовые миниатюры sorl для постов страницы одним запросом.
+
+    Для постов с картинкой, которые воркер ещё не обработал, ключи
+    KV-хранилища читаются одним get_many из кэша и одним запросом
+    к БД для промахов. Результат кладётся в post.prefetched_thumbnail
+    (ImageFile с url и size) или None, если миниатюры ещё нет.
+    """
+    pending = {}
+    for post in posts:
+        post.prefetched_thumbnail = None
+        if post.image and not post.thumbnail_url:
+            pending[add_prefix(_thumbnail_file(post.image).key)] = post
+    if not pending:
+        return
+
+    kv_cache = default.kvstore.cache
+    values = kv_cache.get_many(list(pending))
+    lookups = 1
+    missing = [key for key in pending if key not in values]
+    if missing:
+        stored = dict(KVStore.objects.filter(key__in=missing).values_list("key", "value"))
+        lookups += 1
+        kv_cache.set_many(
+            {key: stored.get(key, EMPTY_VALUE) for key in missing},
+            sorl_settings.THUMBNAIL_CACHE_TIMEOUT,
+        )
+        values.update(stored)
+
+    found = 0
+    for key, post in pending.items():
+        value = values.get(key)
+        if value is not None and value != EMPTY_VALUE:
+            post.prefetched_thumbnail = deserialize_image_file(value)
+            found += 1
+    _count(lookups, len(pending))
+    logger.debug("Миниатюры: %s постов, найдено %s, обращений %s", len(pending), found, lookups)
@@ -0,0 +1,51 @@
+from .models import Post, Follow, TimelineEntry
+
+
+def feed(user):
+    return TimelineEntry.objects.filter(user=user).order_by("-pub_date", "-id")
+
+
+def attach_posts(page):
+    """Подменяет записи ленты на странице их постами, сохраняя порядок."""
+    ids = [entry.post_id for entry in page.object_list]
+    posts = Post.objects.for_listing().in_bulk(ids)
+    page.object_list = [posts[pk] for pk in ids if pk in posts]
+    return page
+
+
+def fan_out(post):
+    followers = Follow.objects.filter(author_id=post.author_id).values_list("user_id", flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post.id, author_id=post.author_id, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    posts = Post.objects.filter(author_id=author_id).values_list("id", "pub_date")
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post_id, author_id=author_id, pub_date=pub_date)
+         for post_id, pub_date in posts.iterator()),
+        ignore_conflicts=True,
+    )
+
+
+def trim(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild(user_ids=None):
+    """Пересобирает ленты из Follow и Post, возвращает число подписок."""
+    follows = Follow.objects.all()
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        follows = follows.filter(user_id__in=user_ids)
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+
+    count = 0
+    for user_id, author_id in follows.values_list("user_id", "author_id").iterator():
+        backfill(user_id, author_id)
+        count += 1
+    return count
@@ -0,0 +1,267 @@
+"""Перенос групп, постов, комментариев и подписок в JSONL.
+
+Каждая строка - {"model": ..., поля}. Порядок: group, user, post,
+comment, follow, так что при загрузке всё, на что ссылается строка,
+уже загружено. Внешние ключи выгружаются по естественным ключам:
+группа по slug, пользователь по username, пост по id.
+
+Выгрузка читает таблицы .iterator(), память не растёт с их размером.
+Загрузка пишет пачками bulk_create без сигналов, с исходными датами
+(create_with_dates), в одной транзакции: ошибка в строке не оставляет
+половину файла в базе. HTML текста считается заново, а счётчики,
+ленты подписок и поисковый индекс пересобираются в конце (rebuild).
+Id постов сохраняются со сдвигом на последний выданный id
+(next_id), поэтому в новой базе они совпадают с исходными. Счётчик
+id сдвигается до вставки каждой пачки (reserve_ids), и записи,
+которые сайт создаёт во время загрузки, не занимают загружаемые id.
+Пароли не переносятся, новые пользователи входят через
+сброс пароля; файлы картинок копируются отдельно.
+"""
+import itertools
+import json
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from . import counters, richtext, search, timeline
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 2000
+
+EXPORTS = (
+    ("group", Group.objects.order_by("id"), {
+        "slug": "slug", "title": "title", "description": "description", "rules": "rules",
+    }),
+    ("user", User.objects.order_by("id"), {
+        "username": "username", "first_name": "first_name", "last_name": "last_name",
+        "email": "email", "date_joined": "date_joined",
+    }),
+    ("post", Post.objects.order_by("id"), {
+        "id": "id", "text": "text", "pub_date": "pub_date", "modified": "modified", "image": "image",
+        "author": "author__username", "group": "group__slug",
+    }),
+    ("comment", Comment.objects.order_by("id"), {
+        "post": "post_id", "author": "author__username", "text": "text", "created": "created",
+    }),
+    ("follow", Follow.objects.order_by("id"), {
+        "user": "user__username", "author": "author__username",
+    }),
+)
+
+
+def _encode(value):
+    # DjangoJSONEncoder обрезал бы время до миллисекунд
+    return value.isoformat()
+
+
+def export(stream, chunk_size=CHUNK_SIZE):
+    """Пишет строки в stream, возвращает {модель: число строк}."""
+    counts = {}
+    for model, queryset, fields in EXPORTS:
+        counts[model] = 0
+        rows = queryset.values_list(*fields.values()).iterator(chunk_size=chunk_size)
+        for row in rows:
+            item = {"model": model, **dict(zip(fields, row))}
+            stream.write(json.dumps(item, default=_encode, ensure_ascii=False) + "\n")
+            counts[model] += 1
+    return counts
+
+
+@contextmanager
+def without_indexes(*models):
+    """Снимает индексы из Meta.indexes на время загрузки и создаёт их заново."""
+    with connection.schema_editor() as editor:
+        for model in models:
+            for index in model._meta.indexes:
+                editor.remove_index(model, index)
+    try:
+        yield
+    finally:
+        with connection.schema_editor() as editor:
+            for model in models:
+                for index in model._meta.indexes:
+                    editor.add_index(model, index)
+
+
+def _dated_fields(model):
+    return [field.attname for field in model._meta.concrete_fields
+            if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)]
+
+
+def create_with_dates(model, objs):
+    """bulk_create, после которого у строк остаются их собственные даты.
+
+    bulk_create проставляет поля auto_now/auto_now_add текущим временем,
+    поэтому даты возвращаются вторым запросом, bulk_update. Поля модели
+    не меняются, и другие потоки в это время сохраняют записи как
+    обычно. У объектов должны быть заданы id.
+    """
+    fields = _dated_fields(model)
+    dates = [[getattr(obj, name) for name in fields] for obj in objs]
+    reserve_ids(model, max(obj.pk for obj in objs))
+    model.objects.bulk_create(objs)
+    for obj, values in zip(objs, dates):
+        for name, value in zip(fields, values):
+            setattr(obj, name, value)
+    model.objects.bulk_update(objs, fields)
+
+
+def _sequence_sql(model):
+    return "pg_get_serial_sequence('{}', 'id')".format(model._meta.db_table)
+
+
+def next_id(model):
+    """Первый id, который не занят в таблице и не выдан счётчиком."""
+    last = model.objects.aggregate(last=Max("id"))["last"] or 0
+    if connection.vendor != "postgresql":
+        return last + 1
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval({})".format(_sequence_sql(model)))
+        return max(last + 1, cursor.fetchone()[0])
+
+
+def reserve_ids(model, last_id):
+    """Сдвигает счётчик id так, чтобы он не выдал id до last_id включительно.
+
+    Вызывается до вставки строк с явными id. setval в PostgreSQL
+    действует сразу, вне транзакции. SQLite (AUTOINCREMENT) сам выдаёт
+    id больше наибольшего в таблице, а пишет в базу один процесс.
+    """
+    if connection.vendor != "postgresql":
+        return
+    sequence = _sequence_sql(model)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT setval({0}, GREATEST(%s, nextval({0})))".format(sequence), [last_id])
+
+
+class Importer:
+    """Копит строки одной модели и пишет их пачками по batch_size."""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.counts = {}
+        self.model = None
+        self.batch = []
+        self.lines = None
+        self.group_ids = {}
+        self.user_ids = {}
+        self.post_offset = None
+        self.comment_ids = None
+
+    def add(self, item, line):
+        model = item.pop("model", None)
+        if not hasattr(self, "_load_{}".format(model)):
+            raise ValueError("Строка {}: неизвестная модель {}".format(line, model))
+        if model != self.model:
+            self.flush()
+            self.model = model
+        self.batch.append(item)
+        self.lines = (self.lines[0] if self.lines else line, line)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            try:
+                getattr(self, "_load_{}".format(self.model))(self.batch)
+            except (KeyError, ValueError) as error:
+                raise ValueError("Строки {}-{}: {}".format(*self.lines, error))
+            self.counts[self.model] = self.counts.get(self.model, 0) + len(self.batch)
+        self.batch = []
+        self.lines = None
+
+    def _ids(self, model, field, values, known):
+        missing = set(values) - set(known)
+        known.update(model.objects.filter(**{field + "__in": missing}).values_list(field, "id"))
+        unknown = set(values) - set(known)
+        if unknown:
+            raise ValueError("Не найдены {} {}: {}".format(model._meta.model_name, field, ", ".join(sorted(unknown))))
+
+    def _load_group(self, items):
+        Group.objects.bulk_create((Group(**item) for item in items), ignore_conflicts=True)
+        self._ids(Group, "slug", [item["slug"] for item in items], self.group_ids)
+
+    def _load_user(self, items):
+        password = make_password(None)
+        User.objects.bulk_create(
+            (User(password=password, date_joined=parse_datetime(item.pop("date_joined")), **item) for item in items),
+            ignore_conflicts=True,
+        )
+        self._ids(User, "username", [item["username"] for item in items], self.user_ids)
+
+    def _load_post(self, items):
+        if self.post_offset is None:
+            self.post_offset = next_id(Post) - 1
+        self._ids(User, "username", [item["author"] for item in items], self.user_ids)
+        self._ids(Group, "slug", [item["group"] for item in items if item["group"]], self.group_ids)
+        posts = []
+        for item in items:
+            post = Post(
+                id=item["id"] + self.post_offset, text=item["text"], image=item["image"],
+                pub_date=parse_datetime(item["pub_date"]), modified=parse_datetime(item["modified"]),
+                author_id=self.user_ids[item["author"]], group_id=self.group_ids.get(item["group"]),
+            )
+            richtext.render_post(post)
+            posts.append(post)
+        create_with_dates(Post, posts)
+
+    def _load_comment(self, items):
+        self._ids(User, "username", [item["author"] for item in items], self.user_ids)
+        if self.comment_ids is None:
+            self.comment_ids = itertools.count(next_id(Comment))
+        comments = []
+        for item in items:
+            comment = Comment(
+                id=next(self.comment_ids),
+                post_id=item["post"] + (self.post_offset or 0), author_id=self.user_ids[item["author"]],
+                text=item["text"], created=parse_datetime(item["created"]),
+            )
+            richtext.render_comment(comment)
+            comments.append(comment)
+        create_with_dates(Comment, comments)
+
+    def _load_follow(self, items):
+        self._ids(User, "username", [item["user"] for item in items] + [item["author"] for item in items],
+                  self.user_ids)
+        Follow.objects.bulk_create((
+            Follow(user_id=self.user_ids[item["user"]], author_id=self.user_ids[item["author"]])
+            for item in items if item["user"] != item["author"]
+        ), ignore_conflicts=True)
+
+
+def load(stream, batch_size=BATCH_SIZE):
+    """Загружает строки из stream, возвращает {модель: число строк}."""
+    importer = Importer(batch_size)
+    with transaction.atomic():
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as error:
+                raise ValueError("Строка {}: {}".format(number, error))
+            importer.add(item, number)
+        importer.flush()
+    return importer.counts
+
+
+def rebuild():
+    """Пересчитывает то, что при обычной записи делают сигналы."""
+    counters.reconcile()
+    timeline.rebuild()
+    search.rebuild()
+    cache.clear()
+
+
+def rate(count, started):
+    elapsed = time.perf_counter() - started
+    return count / elapsed if elapsed else float(count)
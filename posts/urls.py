@@ -1,15 +1,23 @@
 from django.urls import path
-from . import views
+from . import feeds, views
 
 urlpatterns = [
     path("group/<slug:slug>/", views.group_posts, name="group"),
+    path("group/<slug:slug>/rss/", feeds.group_rss, name="group_rss"),
+    path("group/<slug:slug>/atom/", feeds.group_atom, name="group_atom"),
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search_posts, name="search"),
+    path("rss/", feeds.posts_rss, name="rss"),
+    path("atom/", feeds.posts_atom, name="atom"),
     path("<str:username>/", views.profile, name="profile"),
+    path("<str:username>/rss/", feeds.author_rss, name="profile_rss"),
+    path("<str:username>/atom/", feeds.author_atom, name="profile_atom"),
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
     path("<str:username>/unfollow/", views.profile_unfollow, name="profile_unfollow"),
     path("<str:username>/<int:post_id>/", views.post_view, name="post"),
     path("<str:username>/<int:post_id>/edit/", views.post_edit, name="post_edit"),
     path("<str:username>/<int:post_id>/comment/", views.add_comment, name="add_comment"),
+    path("<str:username>/<int:post_id>/comments/", views.post_comments, name="post_comments"),
     path("", views.index, name="index"),
 ]
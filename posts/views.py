@@ -1,14 +1,26 @@
-from django.db.models import Count
-from django.shortcuts import render, get_object_or_404, redirect
+from urllib.parse import urlencode
+
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.http import JsonResponse
+from django.db.models import Q
+from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 
 from .models import Post, Group, Comment, Follow
+from . import generations, pagecache, profiling, search, thumbnails, timeline
+from .authors import is_following, request_author
+from .conditional import conditional_page
 from .forms import PostForm, CommentForm
+from .pagination import CursorPaginator, encode_cursor, paginate
 
 User = get_user_model()
 
+COMMENTS_PER_PAGE = 20
+
 
 def page_not_found(request, exception):
     # Переменная exception содержит отладочную информацию,
@@ -20,35 +32,34 @@ def server_error(request):
     return render(request, "misc/500.html", status=500)
 
 
+@conditional_page(lambda request: [generations.INDEX])
 def index(request):
-    post_list = Post.objects.select_related().order_by(
-        "-pub_date"
-    ).annotate(
-        comment_count=Count('comment_post')
+    post_list = Post.objects.for_listing().order_by(
+        "-pub_date", "-id"
     )
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, 'index.html', context={'page': page, 'paginator': paginator})
+    page, paginator = paginate(request, post_list, 10)
+    return render(request, 'index.html', context={
+        'page': page,
+        'paginator': paginator,
+        'generation': generations.current(generations.INDEX),
+    })
 
 
+@conditional_page(lambda request, slug: [generations.group(slug)])
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = Post.objects.select_related().filter(
+    post_list = Post.objects.for_listing().filter(
         group=group
     ).order_by(
-        "-pub_date"
-    ).annotate(
-        comment_count=Count('comment_post')
+        "-pub_date", "-id"
     )
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    page, paginator = paginate(request, post_list, 10)
 
     return render(request, "group.html", context={
         "group": group,
         "page": page,
         'paginator': paginator,
+        'generation': generations.current(generations.group(group.slug)),
     })
 
 
@@ -69,79 +80,55 @@ def new_post(request):
     return render(request, "post_new.html", context={"form": form})
 
 
+@conditional_page(lambda request, username: [
+    generations.author(request_author(request, username).pk), generations.GROUPS,
+])
 def profile(request, username):
-    user = get_object_or_404(User, username=username)
-    post_count = Post.objects.select_related().filter(author=user.pk).count()
-    post_list = Post.objects.select_related().filter(
-        author=user.pk
+    author = request_author(request, username)
+    post_list = Post.objects.for_listing().filter(
+        author=author.pk
     ).order_by(
-        "-pub_date"
-    ).annotate(
-        comment_count=Count('comment_post')
+        "-pub_date", "-id"
     )
-
-    paginator = Paginator(post_list, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-
-    following_count = Follow.objects.filter(author=user).count()
-    follower_count = Follow.objects.filter(user=user).count()
-
-    if request.user.is_authenticated:
-        following = Follow.objects.filter(user=request.user, author=user).first()
-
-        return render(request, "profile.html", context={
-            "profile": user,
-            "post_count": post_count,
-            "page": page,
-            'paginator': paginator,
-            'following': following,
-            'following_count': following_count,
-            'follower_count': follower_count,
-        })
+    page, paginator = paginate(request, post_list, 5)
 
     return render(request, "profile.html", context={
-        "profile": user,
-        "post_count": post_count,
+        "profile": author,
+        "counters": author.counters,
         "page": page,
         'paginator': paginator,
-        'following_count': following_count,
-        'follower_count': follower_count,
+        'generation': generations.current(generations.author(author.pk), generations.GROUPS),
+        'following': is_following(request.user, author),
     })
 
 
-def post_view(request, username, post_id):
-    user = get_object_or_404(User, username=username)
-    post_count = Post.objects.select_related().filter(author=user.pk).count()
-    post = get_object_or_404(Post, author=user.pk, id=post_id)
-
-    comments = Comment.objects.select_related().filter(post=post_id)
-    form = CommentForm()
+def comments_page(request, post_id, **filters):
+    """Страница комментариев поста по курсору ?after= / ?before=."""
+    paginator = CursorPaginator(
+        Comment.objects.select_related("author").filter(post=post_id, **filters),
+        COMMENTS_PER_PAGE,
+        ordering=("created", "id"),
+    )
+    return paginator.get_page(after=request.GET.get("after"), before=request.GET.get("before"))
 
-    following_count = Follow.objects.filter(author=user).count()
-    follower_count = Follow.objects.filter(user=user).count()
 
-    if request.user.is_authenticated:
-        following = Follow.objects.filter(user=request.user, author=user).first()
-        return render(request, "post.html", context={
-            "profile": user,
-            "post_count": post_count,
-            "post": post,
-            "form": form,
-            "comments": comments,
-            'following': following,
-            'following_count': following_count,
-            'follower_count': follower_count,
-        })
+@conditional_page(lambda request, username, post_id: [
+    generations.author(request_author(request, username).pk), generations.post(post_id),
+])
+def post_view(request, username, post_id):
+    author = request_author(request, username)
+    post = get_object_or_404(Post, author=author.pk, id=post_id)
+    # Автор нужен и форме комментария: не читаем его ещё раз
+    post.author = author
+    thumbnails.prefetch([post])
 
     return render(request, "post.html", context={
-        "profile": user,
-        "post_count": post_count,
+        "profile": author,
+        "counters": author.counters,
         "post": post,
-        "form": form,
-        "comments": comments,
-        'following_count': following_count,
-        'follower_count': follower_count,
+        "form": CommentForm(),
+        "comments": comments_page(request, post.pk),
+        'following': is_following(request.user, author),
     })
 
 
@@ -167,6 +154,28 @@ def post_edit(request, username, post_id):
     return redirect("post", username, post_id)
 
 
+def post_comments(request, username, post_id):
+    """Следующие страницы комментариев, их подгружает post.html."""
+    return render(request, "comments_page.html", {
+        "comments": comments_page(request, post_id, post__author__username=username),
+        "username": username,
+        "post_id": post_id,
+        "fragment": True,
+    })
+
+
+def comment_url(comment, username):
+    """Адрес страницы комментариев, которая начинается с comment."""
+    url = reverse("post", args=(username, comment.post_id))
+    previous = Comment.objects.filter(
+        Q(created__lt=comment.created) | Q(created=comment.created, id__lt=comment.pk),
+        post=comment.post_id,
+    ).order_by("-created", "-id").values_list("created", "id").first()
+    if previous is not None:
+        url += "?" + urlencode({"after": encode_cursor(*previous)})
+    return "{}#comment_{}".format(url, comment.pk)
+
+
 @login_required
 def add_comment(request, username, post_id):
     if request.user.is_authenticated:
@@ -178,7 +187,7 @@ def add_comment(request, username, post_id):
             comment.author = request.user
             comment.post = post
             comment.save()
-            return redirect("post", username, post_id)
+            return redirect(comment_url(comment, username))
 
         return redirect("post", username, post_id)
 
@@ -187,29 +196,32 @@ def add_comment(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    follow = Follow.objects.filter(user=request.user).count()
-    if follow == 0:
-        page = []  # для сдачи тестов
-        return render(request, "follow.html", {'page': page})
-
-    post_list = Post.objects.select_related().order_by(
-        "-pub_date"
-    ).filter(
-        author__following__user=request.user
-    ).annotate(
-        comment_count=Count('comment_post')
-    )
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, "follow.html", {'page': page, 'paginator': paginator})
+    page, paginator = paginate(request, timeline.feed(request.user), 10)
+    timeline.attach_posts(page)
+    return render(request, "follow.html", {
+        'page': page,
+        'paginator': paginator,
+        'generation': generations.current(generations.INDEX, generations.follow(request.user.pk)),
+    })
+
+
+def search_posts(request):
+    query = request.GET.get("q", "").strip()
+    paginator = Paginator(search.search(query), 10)
+    page = search.attach_posts(paginator.get_page(request.GET.get("page")))
+    return render(request, "search.html", {
+        "query": query,
+        "page": page,
+        "paginator": paginator,
+        "page_params": "&" + urlencode({"q": query}) if query else "",
+    })
 
 
 @login_required
 def profile_follow(request, username):
     if request.user.username != username:
         author = User.objects.get(username=username)
-        Follow.objects.create(user=request.user, author=author)
+        Follow.objects.get_or_create(user=request.user, author=author)
         return redirect('profile', username)
     return redirect('profile', username)
 
@@ -218,5 +230,14 @@ def profile_follow(request, username):
 @login_required
 def profile_unfollow(request, username):
     author = User.objects.get(username=username)
-    Follow.objects.get(user=request.user, author=author).delete()
+    Follow.objects.filter(user=request.user, author=author).delete()
     return redirect('profile', username)
+
+
+@staff_member_required
+def stats(request):
+    return JsonResponse({
+        "cache": cache.stats() if hasattr(cache, "stats") else None,
+        "page_cache": pagecache.stats(),
+        "profile": profiling.stats(),
+    })
@@ -0,0 +1,11 @@
+from django.core.mail import send_mail
+
+from posts.outbox import handler
+
+
+@handler("signup_mail")
+def send_mail_ls(payload, connection):
+    send_mail(
+        'Подтверждение регистрации Yatube', 'Вы зарегистрированы!', 'Yatube.ru <admin@yatube.ru>',
+        [payload["email"]], fail_silently=False, connection=connection,
+    )
@@ -1,7 +1,7 @@
-from django.urls import reverse_lazy
+from django.db import transaction
 from django.views.generic import CreateView
-from django.core.mail import send_mail
 
+from posts import outbox
 from .forms import CreationForm
 
 
@@ -11,12 +11,9 @@ class SignUp(CreateView):
     template_name = "signup.html"
 
     def form_valid(self, form):
-        email = form.cleaned_data['email']
-        send_mail_ls(email)
-        return super().form_valid(form)
-
-
-def send_mail_ls(email):
-    send_mail(
-            'Подтверждение регистрации Yatube', 'Вы зарегистрированы!', 'Yatube.ru <admin@yatube.ru>', [email], fail_silently=False
-    )
+        # Письмо отправит воркер run_outbox: регистрация не ждёт почту
+        # и не ломается из-за неё, а без пользователя письма не будет
+        with transaction.atomic():
+            response = super().form_valid(form)
+            outbox.enqueue("signup_mail", email=form.cleaned_data['email'])
+        return response
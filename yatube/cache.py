@@ -0,0 +1,291 @@
+"""Двухуровневый кэш: L1 в памяти процесса перед общим L2.
+
+L2 - любой кэш из settings.CACHES (файловый, БД, memcached), его
+алиас задаётся в LOCATION. Значения в L2 хранятся в конверте
+(value, soft_expiry, delta): после soft_expiry запись ещё живёт
+STALE_GRACE секунд, и пока один процесс, взявший блокировку в L2,
+пересчитывает значение, остальные получают устаревшее. Незадолго
+до soft_expiry пересчёт может начаться раньше с вероятностью,
+растущей к концу срока (XFetch), delta - сколько длился прошлый
+пересчёт. При промахе в L2 блокировку тоже берёт один процесс,
+остальные до MISS_WAIT секунд ждут его значение и только потом
+считают сами. Если тот, кто взял блокировку, значение записывать не
+станет (404, ответ не для кэша), он вызывает delete(): блокировка
+снимается, и ждущие сразу идут считать сами. На случай, если
+delete() не вызвали, блокировка живёт MISS_WAIT, округлённое вверх
+до секунд.
+
+Ключи с префиксами из SHARED_ONLY_PREFIXES хранятся в L2 как есть,
+без конверта и без L1: это счётчики, которые должны сразу быть видны
+всем процессам. Живут они без срока. incr у них атомарный, если он
+атомарный у самого L2 (memcached, LocMem). Файловый кэш и кэш в БД
+такого incr не имеют. Для них чтение и запись идут под блокировкой
+в L2, и срок ключа при этом не сбрасывается. add у файлового кэша
+тоже не атомарный, поэтому между процессами блокировка у него
+только примерная; в продакшене L2 - memcached или кэш в БД.
+"""
+import math
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+from posts.profiling import TimedCache
+
+LOCK_KEY = "{}:rebuild-lock"
+LOCK_POLL = 0.01
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared_alias = location or "shared"
+        self._l1_max_entries = int(options.get("L1_MAX_ENTRIES", 1000))
+        self._l1_timeout = float(options.get("L1_TIMEOUT", 5))
+        self._shared_only = tuple(options.get("SHARED_ONLY_PREFIXES", ()))
+        self._stale_grace = int(options.get("STALE_GRACE", 30))
+        self._lock_timeout = int(options.get("LOCK_TIMEOUT", 10))
+        self._beta = float(options.get("EARLY_EXPIRY_BETA", 1.0))
+        self._miss_wait = float(options.get("MISS_WAIT", 0.5))
+
+        self._l1 = OrderedDict()
+        self._l1_lock = threading.Lock()
+        self._rebuilding = OrderedDict()
+        self._stats = {"l1": Counter(), "l2": Counter()}
+
+    @property
+    def shared(self):
+        # Время обращений к L2 попадает в Server-Timing (posts/profiling.py)
+        return TimedCache(caches[self._shared_alias])
+
+    def stats(self):
+        with self._l1_lock:
+            result = {tier: dict(counter) for tier, counter in self._stats.items()}
+            result["l1"]["entries"] = len(self._l1)
+        return result
+
+    def _native_incr(self):
+        return type(caches[self._shared_alias]).incr is not BaseCache.incr
+
+    def _is_shared_only(self, key):
+        return key.startswith(self._shared_only) if self._shared_only else False
+
+    # L1
+
+    def _l1_get(self, full_key):
+        with self._l1_lock:
+            item = self._l1.get(full_key)
+            if item is None:
+                self._stats["l1"]["misses"] += 1
+                return None
+            entry, expires = item
+            if expires <= time.time():
+                del self._l1[full_key]
+                self._stats["l1"]["misses"] += 1
+                return None
+            self._l1.move_to_end(full_key)
+            self._stats["l1"]["hits"] += 1
+            return entry
+
+    def _l1_set(self, full_key, entry):
+        with self._l1_lock:
+            self._l1[full_key] = (entry, time.time() + self._l1_timeout)
+            self._l1.move_to_end(full_key)
+            while len(self._l1) > self._l1_max_entries:
+                self._l1.popitem(last=False)
+                self._stats["l1"]["evictions"] += 1
+
+    def _mark_rebuilding(self, full_key):
+        with self._l1_lock:
+            self._rebuilding[full_key] = time.monotonic()
+            self._rebuilding.move_to_end(full_key)
+            while len(self._rebuilding) > self._l1_max_entries:
+                self._rebuilding.popitem(last=False)
+
+    def _l1_delete(self, full_key):
+        with self._l1_lock:
+            self._l1.pop(full_key, None)
+
+    # Конверт и блокировка пересчёта
+
+    def _wrap(self, full_key, value, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        with self._l1_lock:
+            started = self._rebuilding.pop(full_key, None)
+        delta = time.monotonic() - started if started is not None else 0
+        if timeout is None:
+            return (value, None, delta), None
+        timeout = max(timeout, 0)
+        return (value, time.time() + timeout, delta), timeout + self._stale_grace
+
+    def _should_rebuild(self, soft_expiry, delta):
+        if soft_expiry is None:
+            return False
+        now = time.time()
+        if now >= soft_expiry:
+            return True
+        return bool(delta) and now - delta * self._beta * math.log(1 - random.random()) >= soft_expiry
+
+    def _fetch_missing(self, key, version, full_key):
+        """Запись из L2 для ключа, которого нет в L1, или None."""
+        entry = self.shared.get(key, version=version)
+        if entry is None:
+            # Целое число секунд: memcached округлил бы 0.5 до "навсегда"
+            lock_timeout = max(math.ceil(self._miss_wait), 1)
+            if not self.shared.add(LOCK_KEY.format(key), 1, timeout=lock_timeout, version=version):
+                # Значение уже считает другой процесс: ждём его
+                lock = LOCK_KEY.format(key)
+                deadline = time.monotonic() + self._miss_wait
+                while time.monotonic() < deadline:
+                    time.sleep(LOCK_POLL)
+                    found = self.shared.get_many([key, lock], version=version)
+                    entry = found.get(key)
+                    if entry is not None or lock not in found:
+                        break
+            if entry is None:
+                self._stats["l2"]["misses"] += 1
+                self._mark_rebuilding(full_key)
+                return None
+            self._stats["l2"]["waits"] += 1
+        else:
+            self._stats["l2"]["hits"] += 1
+        self._l1_set(full_key, entry)
+        return entry
+
+    def _resolve(self, key, version, entry, default):
+        value, soft_expiry, delta = entry
+        if not self._should_rebuild(soft_expiry, delta):
+            return value
+        if self.shared.add(LOCK_KEY.format(key), 1, timeout=self._lock_timeout, version=version):
+            # Этот вызов пересчитает значение, остальные пока получат старое
+            self._mark_rebuilding(self.make_key(key, version))
+            self._stats["l2"]["rebuilds"] += 1
+            return default
+        self._stats["l2"]["stale"] += 1
+        return value
+
+    # API кэша Django
+
+    def get(self, key, default=None, version=None):
+        if self._is_shared_only(key):
+            return self.shared.get(key, default, version=version)
+        full_key = self.make_key(key, version)
+        entry = self._l1_get(full_key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            # Другой процесс мог уже обновить значение в L2
+            entry = None
+        if entry is None:
+            entry = self._fetch_missing(key, version, full_key)
+            if entry is None:
+                return default
+        return self._resolve(key, version, entry, default)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            if self._is_shared_only(key):
+                missing.append(key)
+                continue
+            entry = self._l1_get(self.make_key(key, version))
+            if entry is None:
+                missing.append(key)
+            else:
+                found[key] = entry
+        if missing:
+            shared = self.shared.get_many(missing, version=version)
+            for key in missing:
+                if self._is_shared_only(key):
+                    if key in shared:
+                        found[key] = shared[key]
+                    continue
+                if key in shared:
+                    self._stats["l2"]["hits"] += 1
+                    self._l1_set(self.make_key(key, version), shared[key])
+                    found[key] = shared[key]
+                else:
+                    self._stats["l2"]["misses"] += 1
+
+        result = {}
+        for key, entry in found.items():
+            if self._is_shared_only(key):
+                result[key] = entry
+                continue
+            value = self._resolve(key, version, entry, None)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self._is_shared_only(key):
+            return self.shared.set(key, value, timeout=timeout, version=version)
+        full_key = self.make_key(key, version)
+        entry, shared_timeout = self._wrap(full_key, value, timeout)
+        self.shared.set(key, entry, timeout=shared_timeout, version=version)
+        self._l1_set(full_key, entry)
+        self.shared.delete(LOCK_KEY.format(key), version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        for key, value in data.items():
+            self.set(key, value, timeout=timeout, version=version)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self._is_shared_only(key):
+            return self.shared.add(key, value, timeout=timeout, version=version)
+        full_key = self.make_key(key, version)
+        entry, shared_timeout = self._wrap(full_key, value, timeout)
+        added = self.shared.add(key, entry, timeout=shared_timeout, version=version)
+        if added:
+            self._l1_set(full_key, entry)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        if not self._is_shared_only(key):
+            return super().incr(key, delta, version=version)
+        if self._native_incr():
+            return self.shared.incr(key, delta, version=version)
+        # BaseCache.incr - это get и set: параллельный incr потерял бы
+        # прибавку, а set без timeout поставил бы срок по умолчанию
+        lock = LOCK_KEY.format(key)
+        while not self.shared.add(lock, 1, timeout=self._lock_timeout, version=version):
+            time.sleep(LOCK_POLL)
+        try:
+            value = self.shared.get(key, version=version)
+            if value is None:
+                raise ValueError("Key '%s' not found" % key)
+            value += delta
+            self.shared.set(key, value, timeout=None, version=version)
+            return value
+        finally:
+            self.shared.delete(lock, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self.get(key, version=version)
+        if value is None:
+            return False
+        self.set(key, value, timeout=timeout, version=version)
+        return True
+
+    def has_key(self, key, version=None):
+        return self.get(key, version=version) is not None
+
+    def delete(self, key, version=None):
+        # Снимает и блокировку промаха: значения не будет, ждать нечего
+        self._l1_delete(self.make_key(key, version))
+        self.shared.delete_many([key, LOCK_KEY.format(key)], version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(self.make_key(key, version))
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        with self._l1_lock:
+            self._l1.clear()
+        self.shared.clear()
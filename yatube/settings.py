@@ -66,27 +66,35 @@ INSTALLED_APPS = [
     'django.contrib.sites',
     'django.contrib.flatpages',
     'sorl.thumbnail',
-    'debug_toolbar',
     'ckeditor',
 ]
 
 MIDDLEWARE = [
+    'posts.middleware.ProfilingMiddleware',
+    'posts.middleware.QueryAuditMiddleware',
+    'posts.middleware.SlowQueryViewMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'posts.middleware.PageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# Панель отладки только для разработки: в бою замеры даёт ProfilingMiddleware
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендера (posts/profiling.py)
+        'BACKEND': 'posts.profiling.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -166,18 +174,83 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 SITE_ID = 3
 
 # Logging
+# Каждый SQL-запрос в консоль больше не пишется: медленные и выборочно
+# быстрые запросы пишет в JSON posts/slowlog.py
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
-    "handlers": {"console": {"level": "DEBUG", "class": "logging.StreamHandler"}},
-    "loggers": {"django.db.backends": {"handlers": ["console"], "level": "DEBUG"}},
+    "formatters": {"json": {"()": "posts.slowlog.JsonFormatter"}},
+    "handlers": {"slow_queries": {"class": "logging.StreamHandler", "formatter": "json"}},
+    "loggers": {"posts.slowlog": {"handlers": ["slow_queries"], "level": "INFO", "propagate": False}},
 }
 
+# Журнал медленных запросов: порог в мс, доля быстрых запросов в журнале
+# и EXPLAIN для медленных SELECT
+SLOW_QUERY_LOG = env.bool("SLOW_QUERY_LOG", default=True)
+SLOW_QUERY_MS = env.float("SLOW_QUERY_MS", default=100)
+SLOW_QUERY_SAMPLE_RATE = env.float("SLOW_QUERY_SAMPLE_RATE", default=0.0)
+SLOW_QUERY_EXPLAIN = env.bool("SLOW_QUERY_EXPLAIN", default=False)
+
+# Учёт SQL-запросов страниц и бюджеты из posts/sqlaudit.py
+QUERY_AUDIT = env.bool("QUERY_AUDIT", default=DEBUG)
+
+# Сколько живут страницы в кэше для анонимов (posts/pagecache.py)
+PAGE_CACHE_TIMEOUT = env.int("PAGE_CACHE_TIMEOUT", default=600)
+
+# Кэширующий прокси перед приложением (posts/surrogate.py): сколько
+# он хранит анонимные страницы и куда слать очистку по Surrogate-Key
+PROXY_CACHE_TIMEOUT = env.int("PROXY_CACHE_TIMEOUT", default=600)
+CDN_PURGE_URL = env.str("CDN_PURGE_URL", default="")
+CDN_PURGE_TOKEN = env.str("CDN_PURGE_TOKEN", default="")
+CDN_PURGE_TIMEOUT = env.int("CDN_PURGE_TIMEOUT", default=10)
+
+# Заголовок Server-Timing (только персоналу) и сводка времени по view
+# (posts/profiling.py); доля запросов, которые профилируются cProfile,
+# и куда класть .prof
+PROFILING = env.bool("PROFILING", default=DEBUG)
+PROFILE_SAMPLE_RATE = env.float("PROFILE_SAMPLE_RATE", default=0.0)
+PROFILE_DIR = env.str("PROFILE_DIR", default=os.path.join(BASE_DIR, "profiles"))
+
+# Входит в ETag страниц: поменять при выкладке новых шаблонов
+ETAG_SALT = env.str("ETAG_SALT", default="")
+
+# Пагинация лент: "pages" - номера страниц, "cursor" - курсоры ?after=
+FEED_PAGINATION = env.str("FEED_PAGINATION", default="pages")
+
 # Cache
+# default - двухуровневый кэш (yatube/cache.py): L1 в памяти процесса,
+# L2 - общий для всех воркеров кэш с алиасом из LOCATION.
+# В L2 лежат фрагменты лент (и их варианты по пользователям), карточки
+# постов и авторов, целые страницы, счётчики, поколения и блокировки,
+# поэтому лимит записей у него большой: по умолчанию Django держит
+# всего 300 и при вытеснении потерял бы поколения и блокировки.
+# Файловый кэш подходит для разработки: он перечисляет каталог на
+# каждой записи, а его add и incr не атомарны между процессами. В
+# продакшене shared - memcached (MemcachedCache, LOCATION адрес
+# сервера, без OPTIONS) или DatabaseCache (после createcachetable).
 CACHES = {
-        'default': {
-                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        }
+    'default': {
+        'BACKEND': 'yatube.cache.TwoTierCache',
+        'LOCATION': 'shared',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+            'SHARED_ONLY_PREFIXES': ['generation:'],
+            'STALE_GRACE': 30,
+            'LOCK_TIMEOUT': 10,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env.str('CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache')),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('CACHE_MAX_ENTRIES', default=100000),
+            # При переполнении удаляется 1/CULL_FREQUENCY записей
+            'CULL_FREQUENCY': 10,
+        },
+    },
 }
 
 TEST_CACHE = {
@@ -5,6 +5,8 @@ from django.conf.urls import handler404, handler500
 from django.conf import settings
 from django.conf.urls.static import static
 
+from posts.views import stats
+
 # noinspection PyRedeclaration
 handler404 = "posts.views.page_not_found"
 # noinspection PyRedeclaration
@@ -12,6 +14,8 @@ handler500 = "posts.views.server_error"
 
 urlpatterns = [
     path("panel/admin/", admin.site.urls),
+    path("panel/stats/", stats, name="stats"),
+    path("api/v1/", include("posts.api_urls")),
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),
 ]